@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""
+Times `Pynliner._clean_output` on documents with a growing number of Outlook
+conditional comments. Time per comment should stay flat as the count grows.
+
+    python benchmarks/bench_clean_output.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pynliner import Pynliner
+
+BLOCK = (u'<p>Paragraph text for the email body.</p>\n'
+         u'<!--[if mso]>&lt;table&gt;&lt;tr&gt;&lt;td width="600"&gt;'
+         u'&lt;![endif]-->\n')
+
+
+def bench(comments, repeat=5):
+    p = Pynliner(allow_conditional_comments=True)
+    source = BLOCK * comments
+
+    def clean():
+        p.output = source
+        p._clean_output()
+
+    return min(timeit.repeat(clean, number=1, repeat=repeat))
+
+
+def main():
+    print('%10s %12s %16s' % ('comments', 'total ms', 'us per comment'))
+    for comments in (100, 200, 400, 800, 1600):
+        seconds = bench(comments)
+        print('%10d %12.3f %16.3f' % (comments, seconds * 1e3,
+                                       seconds * 1e6 / comments))
+
+
+if __name__ == '__main__':
+    main()
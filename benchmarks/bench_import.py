@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Times the cold start of pynliner: `import pynliner` and the first inlining
+of a small document, each in a fresh interpreter.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --max-import-ms 50
+
+The fastest of `--repeat` runs is reported, less the start up time of a bare
+interpreter. With `--max-import-ms`, the exit status is 1 if importing takes
+longer.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+SNIPPETS = (
+    ('interpreter', 'pass'),
+    ('import', 'import pynliner'),
+    ('first run', 'import pynliner; pynliner.fromString('
+                  '"<style>h1 { color: red; }</style><h1>Hi</h1>")'),
+)
+
+
+def time_snippet(code, repeat):
+    """Returns the fastest wall time of running `code` in a new interpreter.
+    """
+    command = [sys.executable, '-W', 'ignore', '-c', code]
+    best = None
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        subprocess.check_call(command, cwd=ROOT)
+        seconds = timeit.default_timer() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--max-import-ms', type=float)
+    args = parser.parse_args(argv)
+
+    timings = dict((name, time_snippet(code, args.repeat))
+                   for name, code in SNIPPETS)
+    for name, code in SNIPPETS[1:]:
+        print('%-12s %8.1f ms' % (name, (timings[name] - timings['interpreter']) * 1e3))
+    import_ms = (timings['import'] - timings['interpreter']) * 1e3
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print('REGRESSION import: %.1fms > %.1fms' % (import_ms, args.max_import_ms))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
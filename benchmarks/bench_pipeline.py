@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Times each stage of `Pynliner.run` on the corpora in `corpora.py`.
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --save before.json
+    python benchmarks/bench_pipeline.py --compare before.json
+
+Each corpus is inlined `--repeat` times with a fresh Pynliner and the
+fastest time of every stage is reported. With `--compare`, stages slower
+than the saved results by more than `--tolerance` are listed and the exit
+status is 1.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pynliner import Pynliner
+
+from corpora import CORPORA
+
+STAGES = ('_get_soup', '_get_styles', '_get_index', '_apply_styles',
+          '_get_output', '_clean_output')
+
+
+def time_stages(html, css, parser):
+    """Runs the pipeline once, returning the seconds spent in each stage."""
+    p = Pynliner(allow_conditional_comments=True, parser=parser).from_string(html)
+    if css:
+        p.with_cssString(css)
+    timings = {}
+    for stage in STAGES:
+        start = timeit.default_timer()
+        getattr(p, stage)()
+        timings[stage] = timeit.default_timer() - start
+    return timings
+
+
+def bench(names, repeat, parser):
+    results = {}
+    for name in names:
+        html, css = CORPORA[name]()
+        best = {}
+        for _ in range(repeat):
+            for stage, seconds in time_stages(html, css, parser).items():
+                best[stage] = min(seconds, best.get(stage, seconds))
+        best['total'] = sum(best[stage] for stage in STAGES)
+        results[name] = best
+    return results
+
+
+def report(results):
+    columns = STAGES + ('total',)
+    print('%-14s' % 'ms' + ''.join('%15s' % column.lstrip('_') for column in columns))
+    for name, timings in sorted(results.items()):
+        print('%-14s' % name +
+              ''.join('%15.2f' % (timings[column] * 1e3) for column in columns))
+
+
+def compare(results, baseline, tolerance):
+    """Returns `(corpus, stage, old, new)` for every regressed stage."""
+    regressions = []
+    for name, timings in sorted(results.items()):
+        for stage, seconds in sorted(timings.items()):
+            old = baseline.get(name, {}).get(stage)
+            if old and seconds > old * (1 + tolerance):
+                regressions.append((name, stage, old, seconds))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('corpora', nargs='*', metavar='corpus',
+                        help='one of %s; default: all of them'
+                             % ', '.join(sorted(CORPORA)))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--parser', default='html.parser',
+                        help='BeautifulSoup parser (default: html.parser)')
+    parser.add_argument('--save', metavar='FILE')
+    parser.add_argument('--compare', metavar='FILE')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    for name in args.corpora:
+        if name not in CORPORA:
+            parser.error('unknown corpus %r' % name)
+
+    results = bench(args.corpora or sorted(CORPORA), args.repeat,
+                    args.parser)
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as stream:
+            regressions = compare(results, json.load(stream), args.tolerance)
+        for name, stage, old, new in regressions:
+            print('REGRESSION %s %s: %.2fms -> %.2fms' % (name, stage, old * 1e3, new * 1e3))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
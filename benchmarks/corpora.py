@@ -0,0 +1,120 @@
+"""
+Synthetic email corpora for the benchmarks.
+
+Every corpus is a function returning `(html, css)`, where `css` is extra CSS
+passed with `with_cssString` (the HTML may carry its own <style> blocks too).
+Documents are generated deterministically so timings stay comparable
+between runs.
+"""
+import random
+
+TRANSACTIONAL_CSS = u"""
+body { margin: 0; padding: 0; background: #f4f4f4; }
+.wrapper { width: 100%; background: #f4f4f4; }
+.container { width: 600px; margin: 0 auto; background: #ffffff; }
+h1 { font-family: Helvetica, Arial, sans-serif; font-size: 24px; color: #333333; }
+p { font-family: Helvetica, Arial, sans-serif; font-size: 14px; line-height: 1.5; color: #555555; }
+a { color: #0066cc; text-decoration: none; }
+.button a { display: inline-block; padding: 12px 24px; background: #0066cc; color: #ffffff; }
+.footer p { font-size: 12px; color: #999999; }
+table.order td { padding: 4px 8px; border-bottom: 1px solid #eeeeee; }
+table.order tr:last-child td { border-bottom: none; }
+"""
+
+
+def transactional():
+    """A receipt: a handful of rules and about a hundred elements."""
+    rows = u''.join(
+        u'<tr><td>Item %d</td><td class="qty">1</td><td class="price">$%d.00</td></tr>'
+        % (i, i * 3) for i in range(8))
+    html = (
+        u'<!DOCTYPE html><html><head><style>%s</style></head><body>'
+        u'<table class="wrapper"><tr><td><table class="container"><tr><td>'
+        u'<h1>Thanks for your order</h1><p>Hi Jane, here is your receipt.</p>'
+        u'<table class="order">%s</table>'
+        u'<p class="button"><a href="https://example.com/orders/1">View order</a></p>'
+        u'<div class="footer"><p>Example Inc.</p><p>Unsubscribe</p></div>'
+        u'</td></tr></table></td></tr></table></body></html>'
+    ) % (TRANSACTIONAL_CSS, rows)
+    return html, u''
+
+
+def newsletter(articles=150):
+    """A long newsletter: a medium stylesheet and a couple thousand elements."""
+    rng = random.Random(16)
+    css = TRANSACTIONAL_CSS + u''.join(
+        u'.article-%d h2 { color: #%06x; }\n.tag-%d { background: #%06x; }\n'
+        % (i, rng.randrange(0xffffff), i, rng.randrange(0xffffff))
+        for i in range(40))
+    blocks = []
+    for i in range(articles):
+        blocks.append(
+            u'<table class="container article-%d"><tr><td>'
+            u'<h2>Article %d</h2><p>%s</p>'
+            u'<p><span class="tag-%d">tag</span> <a href="https://example.com/%d">Read more</a></p>'
+            u'<!--[if mso]>&lt;br&gt;<![endif]-->'
+            u'</td></tr></table>\n'
+            % (i % 40, i, u'Lorem ipsum dolor sit amet. ' * 6, i % 40, i))
+    html = (u'<html><head><style>%s</style></head><body><div class="wrapper">%s'
+            u'<div class="footer"><p>Footer</p></div></div></body></html>'
+            % (css, u''.join(blocks)))
+    return html, u''
+
+
+def deep_tables(depth=40, width=4):
+    """Table based layout nested `depth` levels deep, styled with descendant
+    and child selectors."""
+    css = u"""
+    table { border-collapse: collapse; }
+    table td { padding: 0; }
+    table table td { vertical-align: top; }
+    .outer table .cell { color: #333333; }
+    .outer > tr > td > table { width: 100%; }
+    td:first-child { padding-left: 4px; }
+    td:last-child { padding-right: 4px; }
+    """
+    inner = u'<p class="cell">Leaf</p>'
+    for level in range(depth):
+        cells = u''.join(u'<td class="cell">%s</td>' % (inner if i == 0 else u'x')
+                         for i in range(width))
+        inner = u'<table class="level-%d"><tr>%s</tr></table>' % (level, cells)
+    html = u'<html><body><div class="outer">%s</div></body></html>' % inner
+    return html, css
+
+
+def framework(columns=12, rules=600):
+    """A component library stylesheet in the style of Foundation for Emails:
+    hundreds of grid, utility and component rules, most unused by the
+    document."""
+    rng = random.Random(600)
+    parts = []
+    for size in (u'small', u'large'):
+        for column in range(1, columns + 1):
+            parts.append(u'table.body .columns.%s-%d, table.body .column.%s-%d '
+                         u'{ width: %dpx; }\n' % (size, column, size, column,
+                                                 column * 50))
+    components = (u'button', u'callout', u'menu', u'card', u'hero', u'spacer',
+                  u'badge', u'label', u'thumbnail', u'wrapper')
+    while len(parts) < rules:
+        component = rng.choice(components)
+        variant = rng.randrange(20)
+        parts.append(u'table.%s.v%d td a, .%s-%d > tbody > tr > th '
+                     u'{ color: #%06x; padding: %dpx; }\n'
+                     % (component, variant, component, variant,
+                        rng.randrange(0xffffff), rng.randrange(20)))
+    rows = u''.join(
+        u'<tr><th class="columns small-12 large-%d"><table class="button v%d">'
+        u'<tr><td><a href="#">Go %d</a></td></tr></table></th></tr>'
+        % (i % columns + 1, i % 20, i) for i in range(60))
+    html = (u'<html><body><table class="body"><tr><td>'
+            u'<table class="container"><tbody>%s</tbody></table>'
+            u'</td></tr></table></body></html>' % rows)
+    return html, u''.join(parts)
+
+
+CORPORA = {
+    'transactional': transactional,
+    'newsletter': newsletter,
+    'deep_tables': deep_tables,
+    'framework': framework,
+}
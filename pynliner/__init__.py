@@ -32,32 +32,130 @@ THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 __version__ = '0.5.1.1.post3'
 
-import re
+from contextlib import contextmanager
+import importlib
+import sys
+from timeit import default_timer
 
-from bs4 import BeautifulSoup
-import cssutils
 import six
-from six.moves.urllib_parse import urljoin
-from six.moves.urllib_request import urlopen
 
-from .soupselect import select
+from .stats import InlineStats, byte_length
+
+# Names of the submodules re-exported here. They are imported on first use
+# so that `import pynliner` does not load bs4, cssutils and urllib, which
+# dominate the start up of short lived processes.
+_lazy_names = {
+    'DiskResultCache': 'cache',
+    'MemoryResultCache': 'cache',
+    'coalesce': 'output',
+    'conditional_comment_regex': 'output',
+    'iter_soup': 'output',
+    'iter_unescape_conditional_comments': 'output',
+    'unescape_conditional_comment': 'output',
+    'StylePlanCache': 'plan',
+    'get_signature': 'plan',
+    'DocumentIndex': 'soupselect',
+    'MatchContext': 'soupselect',
+    'match_sets': 'soupselect',
+    'select': 'soupselect',
+    'Cascade': 'stylesheet',
+    'CompiledStylesheet': 'stylesheet',
+    'StylesheetCache': 'stylesheet',
+}
+_lazy_modules = ('cache', 'fetch', 'output', 'plan', 'soupselect',
+                 'stylesheet')
+
+
+def __getattr__(name):
+    if name in _lazy_modules:
+        return importlib.import_module('.' + name, __name__)
+    try:
+        module = _lazy_names[name]
+    except KeyError:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            __name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+_default_parser = False
+
+
+def get_default_parser():
+    """Returns the BeautifulSoup parser used when none is given: html5lib
+    under mod_wsgi, to prevent BeautifulSoup incompatibility, otherwise None
+    to let BeautifulSoup pick the best one installed. The check is done
+    once per process.
+    """
+    global _default_parser
+    if _default_parser is False:
+        # Check if mod_wsgi is running
+        # - see http://code.google.com/p/modwsgi/wiki/TipsAndTricks
+        try:
+            from mod_wsgi import version
+            _default_parser = 'html5lib'
+        except ImportError:
+            _default_parser = None
+    return _default_parser
 
 
 class Pynliner(object):
     """Pynliner class"""
 
     soup = False
+    index = False
     style_string = False
     stylesheet = False
     output = False
-
-    def __init__(self, log=None, allow_conditional_comments=False):
+    _run_stats = None
+    _matches = None
+    _styled_extra_count = 0
+
+    def __init__(self, log=None, allow_conditional_comments=False,
+                 stylesheet=None, style_cache=None, fetcher=None,
+                 parser=None, stats=None, incremental=False,
+                 result_cache=None, plan_cache=None):
         self.log = log
-        cssutils.log.enabled = False if log is None else True
+        self.incremental = incremental
+        self.result_cache = result_cache
+        self.plan_cache = plan_cache
+        self.parser = parser
+        self.stats = stats
+        self.style_cache = style_cache
+        self._fetcher = fetcher
+        if 'cssutils' in sys.modules:
+            # otherwise done when the first CSS is compiled
+            self._set_cssutils_log()
         self.extra_style_strings = []
+        self.compiled_stylesheets = []
+        self._late_stylesheets = []
+        self._dirty_elements = {}
         self.allow_conditional_comments = allow_conditional_comments
         self.root_url = None
         self.relative_url = None
+        if stylesheet is not None:
+            self.with_compiled_css(stylesheet)
+
+    @property
+    def fetcher(self):
+        """The fetcher given as `fetcher`, or `fetch.default_fetcher`."""
+        if self._fetcher is None:
+            from .fetch import default_fetcher
+            self._fetcher = default_fetcher
+        return self._fetcher
+
+    @fetcher.setter
+    def fetcher(self, fetcher):
+        self._fetcher = fetcher
+
+    def _set_cssutils_log(self):
+        """Enables the global cssutils log if this object has a `log`,
+        disables it otherwise. Only written when it changes.
+        """
+        import cssutils
+        enabled = self.log is not None
+        if cssutils.log.enabled != enabled:
+            cssutils.log.enabled = enabled
 
     def from_url(self, url):
         """Gets remote HTML page for conversion
@@ -78,6 +176,17 @@ class Pynliner(object):
         self.source_string = self._get_url(self.url)
         return self
 
+    def afrom_url(self, url):
+        """Asynchronous version of `from_url`. The page is downloaded on the
+        event loop's default executor.
+
+        Returns an awaitable resolving to self.
+
+        >>> p = await Pynliner().afrom_url('http://somewebsite.com/file.html')
+        """
+        from .aio import afrom_url
+        return afrom_url(self, url)
+
     def from_string(self, string):
         """Generates a Pynliner object from the given HTML string.
 
@@ -93,6 +202,10 @@ class Pynliner(object):
     def with_cssString(self, css_string):
         """Adds external CSS to the Pynliner object. Can be "chained".
 
+        CSS added after a run is only applied by later runs of a
+        Pynliner(incremental=True), which match just its rules against the
+        document.
+
         Returns self.
 
         >>> html = "<h1>Hello World!</h1>"
@@ -104,6 +217,60 @@ class Pynliner(object):
         self.extra_style_strings.append(css_string)
         return self
 
+    def with_compiled_css(self, stylesheet):
+        """Adds a precompiled CompiledStylesheet to the Pynliner object. Can
+        be "chained". Compiled stylesheets are applied after all other CSS, in
+        the order they were added, and can be shared by any number of Pynliner
+        objects.
+
+        Returns self.
+
+        >>> css = CompiledStylesheet("h1 { color:#ffcc00; }")
+        >>> p = Pynliner()
+        >>> p.from_string("<h1>Hello World!</h1>").with_compiled_css(css)
+        <pynliner.Pynliner object at 0x2ca810>
+        """
+        self.compiled_stylesheets.append(stylesheet)
+        return self
+
+    def replace_fragment(self, element, html):
+        """Replaces `element` of `self.soup` with the nodes parsed from the
+        HTML string `html`. Needs `incremental=True`: the next run rematches
+        and restyles every descendant of the parent of `element`, whose
+        matches can change through sibling and descendant combinators and
+        structural pseudo-classes. Replacing a child of <body> rematches the
+        whole document.
+
+        Returns the list of nodes inserted in place of `element`.
+
+        >>> p = Pynliner(incremental=True).from_string(html)
+        >>> p.run()
+        >>> p.replace_fragment(p.soup.find(id='intro'), '<p id="intro">Hi</p>')
+        [<p id="intro">Hi</p>]
+        >>> p.run()
+        """
+        if not self.incremental or self._matches is None:
+            raise ValueError('replace_fragment needs a run with '
+                             'Pynliner(incremental=True) first')
+        parent = element.parent
+        for el in [element] + element.find_all(True):
+            self._matches.pop(id(el), None)
+            self._original_styles.pop(id(el), None)
+            self._dirty_elements.pop(id(el), None)
+        from bs4 import BeautifulSoup
+        # lxml and html5lib would wrap the fragment in <html><body>
+        fragment = BeautifulSoup(html, 'html.parser')
+        nodes = list(fragment.contents)
+        for node in nodes:
+            element.insert_before(node.extract())
+        element.extract()
+        # structural pseudo-classes and sibling combinators of the parent's
+        # other children may now match differently, their descendants
+        # through them
+        for el in parent.find_all(True):
+            self._dirty_elements[id(el)] = el
+        return nodes
+
     def run(self):
         """Applies each step of the process if they have not already been
         performed.
@@ -114,66 +281,292 @@ class Pynliner(object):
         >>> Pynliner().from_string(html).run()
         u'<h1 style="color: #fc0">Hello World!</h1>'
         """
+        self._begin_stats()
+        key = self._get_result_key()
+        if not self._get_cached_output(key):
+            self._inline()
+            with self._timed('get_output'):
+                self._get_output()
+            with self._timed('clean_output'):
+                self._clean_output()
+            if key is not None:
+                self.result_cache[key] = self.output
+        self._end_stats(byte_length(self.output))
+        return self.output
+
+    def iter_output(self, chunk_size=65536):
+        """Applies styles like `run`, but yields the Unicode output in chunks
+        of roughly `chunk_size` characters instead of building it as one
+        string, restoring conditional comments as it goes.
+
+        >>> html = "<style>h1 { color:#ffcc00; }</style><h1>Hello World!</h1>"
+        >>> list(Pynliner().from_string(html).iter_output())
+        [u'<h1 style="color: #fc0">Hello World!</h1>']
+        """
+        self._begin_stats()
+        key = self._get_result_key()
+        if self._get_cached_output(key):
+            # already cached, nothing to store
+            key = None
+            chunks = (self.output[start:start + chunk_size]
+                      for start in range(0, len(self.output), chunk_size))
+        else:
+            from .output import (coalesce, iter_soup,
+                                 iter_unescape_conditional_comments)
+            self._inline()
+            chunks = coalesce(iter_soup(self.soup), chunk_size)
+            if self.allow_conditional_comments:
+                chunks = iter_unescape_conditional_comments(chunks)
+        written = []
+        bytes_out = 0
+        for chunk in chunks:
+            if self._run_stats is not None:
+                bytes_out += byte_length(chunk)
+            if key is not None:
+                written.append(chunk)
+            yield chunk
+        if key is not None:
+            self.result_cache[key] = u''.join(written)
+        self._end_stats(bytes_out)
+
+    def run_to(self, fileobj, chunk_size=65536):
+        """Applies styles like `run` and writes the Unicode output to the
+        text file object `fileobj` in chunks, see `iter_output`.
+        """
+        for chunk in self.iter_output(chunk_size):
+            fileobj.write(chunk)
+
+    def _inline(self):
+        """Applies the steps before serialization that have not already been
+        performed.
+        """
         if not self.soup:
-            self._get_soup()
+            with self._timed('get_soup'):
+                self._get_soup()
         if not self.stylesheet:
-            self._get_styles()
-        self._apply_styles()
-        self._get_output()
-        self._clean_output()
-        return self.output
+            with self._timed('get_styles'):
+                self._get_styles()
+        if not self.index:
+            with self._timed('get_index'):
+                self._get_index()
+        with self._timed('apply_styles'):
+            self._apply_styles()
+
+    def _get_result_key(self):
+        """Returns the `result_cache` key of the output: a digest of the
+        HTML, the CSS and the options the output depends on. Returns None
+        without a `result_cache` or in incremental mode.
+
+        Stylesheets linked from the HTML are keyed by their URL, not their
+        content.
+        """
+        if self.result_cache is None or self.incremental:
+            return None
+        import hashlib
+        extra_style_strings = self.extra_style_strings
+        if self.stylesheet:
+            # CSS added after the first run is not applied
+            extra_style_strings = extra_style_strings[:self._styled_extra_count]
+        parts = ([self.source_string] + extra_style_strings +
+                 [stylesheet.css_string
+                  for stylesheet in self.compiled_stylesheets] +
+                 [repr(self.allow_conditional_comments),
+                  self.parser or get_default_parser() or u'',
+                  self.relative_url or self.root_url or u''])
+        digest = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, six.text_type):
+                part = part.encode('utf-8')
+            # length prefixed, so parts cannot run into each other
+            digest.update(('%d:' % len(part)).encode('ascii'))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _get_cached_output(self, key):
+        """Sets `self.output` to the output cached under `key`, if any.
+
+        Returns True if it was found.
+        """
+        if key is None:
+            return False
+        output = self.result_cache.get(key)
+        stats = self._run_stats
+        if stats is not None:
+            if output is None:
+                stats.result_misses += 1
+            else:
+                stats.result_hits += 1
+        if output is None:
+            return False
+        self.output = output
+        return True
+
+    def _begin_stats(self):
+        """Starts recording a run into `self.stats`, or into a fresh
+        InlineStats if `self.stats` is a callback.
+        """
+        if self.stats is None:
+            self._run_stats = None
+            return
+        if isinstance(self.stats, InlineStats):
+            self._run_stats = self.stats
+        else:
+            self._run_stats = InlineStats()
+        self._run_stats.runs += 1
+        self._run_stats.bytes_in += byte_length(self.source_string)
+
+    def _end_stats(self, bytes_out):
+        stats = self._run_stats
+        if stats is None:
+            return
+        stats.bytes_out += bytes_out
+        self._run_stats = None
+        if stats is not self.stats:
+            self.stats(stats)
+
+    @contextmanager
+    def _timed(self, stage):
+        """Adds the time spent in the block to `stage` of the current run's
+        stats, if any.
+        """
+        stats = self._run_stats
+        if stats is None:
+            yield
+            return
+        start = default_timer()
+        try:
+            yield
+        finally:
+            stats.add_time(stage, default_timer() - start)
+
+    def arun(self, executor=None):
+        """Asynchronous version of `run`. Fetching <link> stylesheets and
+        inlining happen on `executor`, the event loop's default executor if
+        None, so the loop keeps serving other tasks meanwhile.
+
+        Returns an awaitable resolving to the Unicode output.
+
+        >>> output = await Pynliner().from_string(html).arun()
+        """
+        from .aio import arun
+        return arun(self, executor)
+
+    def run_many(self, sources):
+        """Inlines each HTML string of the iterable `sources` with this
+        object's CSS and options, yielding the outputs lazily in order.
+
+        CSS added with `with_cssString` is compiled once for the whole batch,
+        and the documents' own <style> and <link> CSS goes through
+        `self.style_cache` (or a cache private to the batch), so identical
+        blocks are only parsed once.
+
+        >>> p = Pynliner().with_cssString("h1 { color:#ffcc00; }")
+        >>> list(p.run_many(["<h1>Hello</h1>", "<h1>World</h1>"]))
+        [u'<h1 style="color: #fc0">Hello</h1>', u'<h1 style="color: #fc0">World</h1>']
+        """
+        from .stylesheet import CompiledStylesheet, StylesheetCache
+        stylesheets = list(self.compiled_stylesheets)
+        if self.extra_style_strings:
+            self._set_cssutils_log()
+            stylesheets.insert(0, CompiledStylesheet(
+                u''.join(self.extra_style_strings), log=self.log))
+        style_cache = self.style_cache
+        if style_cache is None:
+            style_cache = StylesheetCache()
+        for source in sources:
+            inliner = Pynliner(self.log, self.allow_conditional_comments,
+                               style_cache=style_cache, fetcher=self.fetcher,
+                               parser=self.parser, stats=self.stats,
+                               result_cache=self.result_cache,
+                               plan_cache=self.plan_cache)
+            inliner.compiled_stylesheets = list(stylesheets)
+            inliner.root_url = self.root_url
+            inliner.relative_url = self.relative_url
+            yield inliner.from_string(source).run()
 
     def _get_url(self, url):
         """Returns the response content from the given url
         """
-        return urlopen(url).read()
+        return self.fetcher.fetch(url)
+
+    def _get_urls(self, urls):
+        """Returns the response contents from the given urls, fetching up to
+        `self.fetcher.max_workers` of them concurrently.
+        """
+        if len(urls) < 2:
+            return [self._get_url(url) for url in urls]
+        max_workers = min(len(urls), self.fetcher.max_workers)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self._get_url, urls))
 
     def _get_soup(self):
         """Convert source string to BeautifulSoup object. Sets it to self.soup.
 
-        If using mod_wgsi, use html5 parsing to prevent BeautifulSoup
-        incompatibility.
+        Uses the BeautifulSoup parser given as `parser`, e.g. "lxml" for
+        speed on large documents, or `get_default_parser()`.
         """
-        # Check if mod_wsgi is running
-        # - see http://code.google.com/p/modwsgi/wiki/TipsAndTricks
-        try:
-            from mod_wsgi import version
-            self.soup = BeautifulSoup(self.source_string, "html5lib")
-        except ImportError:
-            self.soup = BeautifulSoup(self.source_string)
+        parser = self.parser or get_default_parser()
+        from bs4 import BeautifulSoup
+        self.soup = BeautifulSoup(self.source_string, parser)
 
     def _get_styles(self):
         """Gets all CSS content from and removes all <link rel="stylesheet"> and
         <style> tags concatenating into one CSS string which is then parsed with
-        cssutils and the resulting CSSStyleSheet object set to
+        cssutils and the resulting CompiledStylesheet object set to
         `self.stylesheet`.
+
+        If a StylesheetCache was given as `style_cache`, CSS that has been
+        seen before is taken from the cache instead of being parsed again.
         """
+        from .stylesheet import CompiledStylesheet
+        self._set_cssutils_log()
         self._get_external_styles()
         self._get_internal_styles()
         for style_string in self.extra_style_strings:
             self.style_string += style_string
-        cssparser = cssutils.CSSParser(log=self.log)
-        self.stylesheet = cssparser.parseString(self.style_string)
+        self._styled_extra_count = len(self.extra_style_strings)
+        del self._late_stylesheets[:]
+        if self.style_cache is not None:
+            hits, misses = self.style_cache.hits, self.style_cache.misses
+            self.stylesheet = self.style_cache.compile(self.style_string,
+                                                       log=self.log)
+            if self._run_stats is not None:
+                self._run_stats.cache_hits += self.style_cache.hits - hits
+                self._run_stats.cache_misses += self.style_cache.misses - misses
+        else:
+            self.stylesheet = CompiledStylesheet(self.style_string,
+                                                 log=self.log)
 
     def _get_external_styles(self):
         """Gets <link> element styles
         """
+        from six.moves.urllib_parse import urljoin
         if not self.style_string:
             self.style_string = u''
         else:
             self.style_string += u'\n'
 
         link_tags = self.soup.findAll('link', {'rel': 'stylesheet'})
+        urls = []
         for tag in link_tags:
             url = tag['href']
 
             # Convert the relative URL to an absolute URL ready to pass to urllib
             base_url = self.relative_url or self.root_url
-            url = urljoin(base_url, url)
-
-            self.style_string += self._get_url(url)
+            urls.append(urljoin(base_url, url))
             tag.extract()
 
+        start = default_timer()
+        contents = self._get_urls(urls)
+        if self._run_stats is not None and urls:
+            self._run_stats.fetches += len(urls)
+            self._run_stats.fetch_time += default_timer() - start
+        for content in contents:
+            if isinstance(content, six.binary_type):
+                content = content.decode('utf-8', 'replace')
+            self.style_string += content
+
     def _get_internal_styles(self):
         """Gets <style> element styles
         """
@@ -188,65 +581,183 @@ class Pynliner(object):
             if tag.get('leave', 'false') != 'true':
                 tag.extract()
 
-    def _get_specificity_from_list(self, lst):
+    def _get_stylesheets(self):
+        """Returns every stylesheet to apply in cascade order. In incremental
+        mode, the CSS given with `with_cssString` since `_get_styles` ran is
+        compiled into a stylesheet of its own.
         """
-        Takes an array of ints and returns an integer formed
-        by adding all ints multiplied by the power of 10 of the current index
-
-        (1, 0, 0, 1) => (1 * 10**3) + (0 * 10**2) + (0 * 10**1) + (1 * 10**0) => 1001
+        if not self.incremental:
+            return [self.stylesheet] + self.compiled_stylesheets
+        from .stylesheet import CompiledStylesheet
+        styled = self._styled_extra_count + len(self._late_stylesheets)
+        for css_string in self.extra_style_strings[styled:]:
+            self._late_stylesheets.append(
+                CompiledStylesheet(css_string, log=self.log))
+        return ([self.stylesheet] + self._late_stylesheets +
+                self.compiled_stylesheets)
+
+    def _get_index(self):
+        """Index the elements of `self.soup` by tag, id and class in one walk
+        and set it to `self.index`. Done after `_get_styles` removes the
+        <link> and <style> elements.
         """
-        return int(''.join(map(str, lst)))
-
-    def _get_rule_specificity(self, rule):
-        """
-        For a given CSSRule get its selector specificity in base 10
-        """
-        return sum(map(self._get_specificity_from_list, (s.specificity for s in rule.selectorList)))
+        from .soupselect import DocumentIndex
+        self.index = DocumentIndex(self.soup)
 
     def _apply_styles(self):
         """Steps through CSS rules and applies each to all the proper elements
         as @style attributes prepending any current @style attributes.
         """
-        rules = self.stylesheet.cssRules.rulesOfType(1)
-        elem_prop_map = {}
-        elem_style_map = {}
-
-        # build up a property list for every styled element
-        for rule in rules:
-            # select elements for every selector
-            selectors = rule.selectorText.split(',')
-            elements = []
-            for selector in selectors:
-                elements += select(self.soup, selector)
-            # build prop_list for each selected element
-            for element in elements:
-                element_tuple = (element, id(element))
-                if element_tuple not in elem_prop_map:
-                    elem_prop_map[element_tuple] = []
-                elem_prop_map[element_tuple].append({
-                    'specificity': self._get_rule_specificity(rule),
-                    'props': rule.style.getProperties(),
-                })
-
-        # build up another property list using selector specificity
-        for elem_tuple, props in elem_prop_map.items():
-            if elem_tuple not in elem_style_map:
-                elem_style_map[elem_tuple] = cssutils.css.CSSStyleDeclaration()
-            # ascending sort of prop_lists based on specificity
-            props = sorted(props, key=lambda p: p['specificity'])
-            # for each prop_list, apply to CSSStyleDeclaration
-            for prop_list in map(lambda obj: obj['props'], props):
-                for prop in prop_list:
-                    elem_style_map[elem_tuple].removeProperty(prop.name)
-                    elem_style_map[elem_tuple].setProperty(prop.name, prop.value)
+        if self.incremental:
+            return self._apply_styles_incrementally()
+        stylesheets = self._get_stylesheets()
+        stats = self._run_stats
+        plan = plan_key = None
+        if self.plan_cache is not None:
+            plan_key, elements = self._get_plan_key(stylesheets)
+            plan = self.plan_cache.get(plan_key)
+            if stats is not None:
+                if plan is None:
+                    stats.plan_misses += 1
+                else:
+                    stats.plan_hits += 1
+        if plan is not None:
+            # same structure and CSS as the document the plan was made for
+            elem_style_list = [(elements[position], style)
+                               for position, style in plan]
+        else:
+            elem_style_list = self._match_styles(stylesheets)
+            if plan_key is not None:
+                positions = dict((id(element), position)
+                                 for position, element in enumerate(elements))
+                self.plan_cache[plan_key] = [
+                    (positions[id(element)], style)
+                    for element, style in elem_style_list]
+
+        if stats is not None:
+            stats.rules += sum(len(stylesheet.rules) for stylesheet in stylesheets)
+            stats.elements_matched += len(elem_style_list)
 
         # apply rules to elements
-        for elem_tuple, style_declaration in elem_style_map.items():
-            elem, elem_id = elem_tuple
+        for elem, style in elem_style_list:
             if elem.has_attr('style'):
-                elem['style'] = u'%s; %s' % (style_declaration.cssText.replace('\n', ' '), elem['style'])
+                elem['style'] = u'%s; %s' % (style, elem['style'])
+            else:
+                elem['style'] = style
+
+    def _match_styles(self, stylesheets):
+        """Returns ``(element, style)`` for every element of `self.soup`
+        matched by some rule of `stylesheets`, in document order, with the
+        declarations of its rules cascaded into `style`.
+        """
+        from .soupselect import match_sets
+        # build up a cascade for every styled element in a single walk
+        selector_sets = [stylesheet.selectors for stylesheet in stylesheets]
+        if self.index:
+            # drop the rules needing a tag, id or class absent from the soup
+            selector_sets = [selectors.filtered(self.index)
+                             for selectors in selector_sets]
+        return [(element, self._cascade(matched_rules))
+                for element, matched_rules
+                in match_sets(self.soup, selector_sets, self._run_stats)]
+
+    def _get_plan_key(self, stylesheets):
+        """Returns ``(key, elements)``: the `plan_cache` key of the soup
+        styled with `stylesheets`, made of the stylesheets' digests and the
+        structural signature of the soup, and its elements in document order.
+        """
+        from .plan import get_signature
+        attributes = set()
+        for stylesheet in stylesheets:
+            attributes.update(stylesheet.attributes)
+        signature, elements = get_signature(self.soup, attributes)
+        key = tuple(stylesheet.digest for stylesheet in stylesheets)
+        return key + (signature,), elements
+
+    def _apply_styles_incrementally(self):
+        """Like `_apply_styles`, but keeps the rules matching each element
+        per stylesheet along with its own @style attribute, so that a later
+        run only matches stylesheets added since and the elements changed by
+        `replace_fragment`, and only restyles the elements concerned.
+        """
+        from .soupselect import MatchContext, match_sets
+        if self._matches is None:
+            # id(element) -> (element, {id(stylesheet): matched rules})
+            self._matches = {}
+            self._original_styles = {}
+            self._matched_stylesheets = set()
+        stylesheets = self._get_stylesheets()
+        stats = self._run_stats
+        context = MatchContext()
+        restyle = {}
+
+        dirty, self._dirty_elements = self._dirty_elements, {}
+        for element in dirty.values():
+            matches = {}
+            for stylesheet in stylesheets:
+                if id(stylesheet) in self._matched_stylesheets:
+                    rules = stylesheet.selectors.match(element, stats=stats,
+                                                       context=context)
+                    if rules:
+                        matches[id(stylesheet)] = rules
+            self._matches[id(element)] = (element, matches)
+            restyle[id(element)] = element
+
+        for stylesheet in stylesheets:
+            if id(stylesheet) in self._matched_stylesheets:
+                continue
+            self._matched_stylesheets.add(id(stylesheet))
+            for element, rules in match_sets(self.soup, [stylesheet.selectors],
+                                             stats):
+                entry = self._matches.setdefault(id(element), (element, {}))
+                entry[1][id(stylesheet)] = rules
+                restyle[id(element)] = element
+
+        for element in restyle.values():
+            original = self._original_styles.setdefault(id(element),
+                                                        element.get('style'))
+            matched_rules = []
+            for stylesheet in stylesheets:
+                matched_rules.extend(
+                    self._matches[id(element)][1].get(id(stylesheet), ()))
+            style = self._cascade(matched_rules) if matched_rules else None
+            if style is not None and original is not None:
+                style = u'%s; %s' % (style, original)
+            elif style is None:
+                style = original
+            if style is not None:
+                element['style'] = style
+            elif element.has_attr('style'):
+                del element['style']
+
+        if stats is not None:
+            stats.rules += sum(len(stylesheet.rules) for stylesheet in stylesheets)
+            stats.elements_matched += len(restyle)
+
+    @staticmethod
+    def _cascade(matched_rules):
+        """Returns the declarations of `matched_rules`, ``(specificity,
+        rule)`` pairs of the matching selectors given in source order,
+        cascaded into a @style attribute value.
+        """
+        from .stylesheet import Cascade
+        rules = []
+        for specificity, rule in matched_rules:
+            # an element matched by several selectors of a rule gets the
+            # rule's properties once, with the highest of their specificities
+            if rules and rule is rules[-1][1]:
+                if specificity > rules[-1][0]:
+                    rules[-1] = (specificity, rule)
             else:
-                elem['style'] = style_declaration.cssText.replace('\n', ' ')
+                rules.append((specificity, rule))
+        # rules are matched in source order, so a stable ascending sort
+        # on the precomputed specificity orders them by
+        # (specificity, source order)
+        rules.sort(key=lambda entry: entry[0])
+        cascade = Cascade()
+        for specificity, rule in rules:
+            cascade.apply(rule)
+        return cascade.serialize()
 
     def _get_output(self):
         """Generate Unicode string of `self.soup` and set it to `self.output`
@@ -260,13 +771,10 @@ class Pynliner(object):
         """Clean up after BeautifulSoup's output.
         """
         if self.allow_conditional_comments:
-            matches = re.finditer('(<!--\[if .+\].+?&lt;!\[endif\]-->)', self.output)
-            for match in matches:
-                comment = match.group()
-                comment = comment.replace('&gt;', '>')
-                comment = comment.replace('&lt;', '<')
-                self.output = (self.output[:match.start()] + comment +
-                               self.output[match.end():])
+            from .output import (conditional_comment_regex,
+                                 unescape_conditional_comment)
+            self.output = conditional_comment_regex.sub(
+                unescape_conditional_comment, self.output)
 
 
 def fromURL(url, log=None):
@@ -286,3 +794,26 @@ def fromString(string, log=None):
     Returns processed HTML string.
     """
     return Pynliner(log).from_string(string).run()
+
+def inline_batch(sources, css=None, log=None, allow_conditional_comments=False,
+                 parser=None):
+    """Inlines every HTML string of the iterable `sources` with the shared
+    `css`, which may be a CSS string or a CompiledStylesheet. Equivalent to:
+
+    >>> Pynliner().with_cssString(css).run_many(sources)
+
+    Returns a generator of processed HTML strings.
+    """
+    from .stylesheet import CompiledStylesheet
+    inliner = Pynliner(log, allow_conditional_comments, parser=parser)
+    if isinstance(css, CompiledStylesheet):
+        inliner.with_compiled_css(css)
+    elif css:
+        inliner.with_cssString(css)
+    return inliner.run_many(sources)
+
+
+if sys.version_info < (3, 7):
+    # no module __getattr__ before Python 3.7 (PEP 562)
+    for _name in _lazy_names:
+        __getattr__(_name)
@@ -0,0 +1,30 @@
+"""
+asyncio support for Pynliner, on Python 3.5+.
+
+Downloads and inlining run on executors so the event loop is never blocked.
+Use these through `Pynliner.afrom_url` and `Pynliner.arun`:
+
+>>> p = await Pynliner().afrom_url('http://somewebsite.com/file.html')
+>>> output = await p.arun()
+"""
+import asyncio
+
+
+async def afrom_url(inliner, url):
+    """Runs `inliner.from_url(url)` on the loop's default executor.
+
+    Returns `inliner`.
+    """
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, inliner.from_url, url)
+    return inliner
+
+
+async def arun(inliner, executor=None):
+    """Runs `inliner.run()`, including fetching <link> stylesheets, on
+    `executor` (the loop's default executor when None).
+
+    Returns Unicode output with applied styles.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(executor, inliner.run)
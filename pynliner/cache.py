@@ -0,0 +1,152 @@
+"""
+Small caching helpers shared by the pynliner modules.
+"""
+from collections import OrderedDict
+import io
+import os
+import tempfile
+import threading
+
+from .stats import byte_length
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping holding at most `maxsize` entries, discarding the
+    least recently used entry when full.
+
+    >>> cache = LRUCache(maxsize=2)
+    >>> cache['a'] = 1
+    >>> cache.get('a')
+    1
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Returns the value for `key`, counting the lookup as a hit or miss.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class MemoryResultCache(LRUCache):
+    """
+    An in-process cache of Pynliner outputs, holding at most `maxsize`
+    entries and `max_bytes` bytes of UTF-8 encoded output, discarding the
+    least recently used entries first.
+
+    >>> cache = MemoryResultCache(max_bytes=32 * 1024 * 1024)
+    >>> Pynliner(result_cache=cache).from_string(html).run()
+    """
+
+    def __init__(self, maxsize=1024, max_bytes=64 * 1024 * 1024):
+        super(MemoryResultCache, self).__init__(maxsize)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sizes = {}
+
+    def __setitem__(self, key, value):
+        size = byte_length(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+                self.size -= self._sizes.pop(key)
+            self._data[key] = value
+            self._sizes[key] = size
+            self.size += size
+            while len(self._data) > self.maxsize or self.size > self.max_bytes:
+                old_key, _ = self._data.popitem(last=False)
+                self.size -= self._sizes.pop(old_key)
+
+    def clear(self):
+        with self._lock:
+            self._sizes.clear()
+            self.size = 0
+        super(MemoryResultCache, self).clear()
+
+
+class DiskResultCache(object):
+    """
+    A cache of Pynliner outputs stored as one UTF-8 file per entry in
+    `directory`, so it can be shared by worker processes and outlive them.
+    Entries are written to a temporary file first and renamed into place.
+
+    >>> cache = DiskResultCache('/var/cache/pynliner')
+    >>> Pynliner(result_cache=cache).from_string(html).run()
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.html')
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key, default=None):
+        """Returns the value for `key`, counting the lookup as a hit or miss.
+        """
+        try:
+            with io.open(self._path(key), encoding='utf-8', newline='') as stream:
+                value = stream.read()
+        except (IOError, OSError):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with io.open(fd, 'w', encoding='utf-8', newline='') as stream:
+                stream.write(value)
+            getattr(os, 'replace', os.rename)(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.html'):
+                os.remove(os.path.join(self.directory, name))
+        self.hits = 0
+        self.misses = 0
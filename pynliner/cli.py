@@ -0,0 +1,202 @@
+"""
+The `pynliner` command: inlines CSS into a single document, a directory
+tree of documents or a JSON-lines stream.
+
+    pynliner email.html > inlined.html
+    pynliner --css base.css -j 8 templates/ -o build/
+    pynliner --css base.css --jsonl < emails.jsonl > inlined.jsonl
+
+In JSON-lines mode each input line is an object whose "html" member is
+inlined; other members are copied to the output line as they are. Outputs
+are written as soon as they are done, in input order, and a summary of the
+throughput is printed on stderr at the end.
+
+HTML files are read as bytes and decoded by BeautifulSoup, which detects
+their encoding. CSS files must be UTF-8.
+"""
+import argparse
+from collections import deque
+import fnmatch
+import io
+import json
+import os
+import sys
+from timeit import default_timer
+
+from . import Pynliner
+from .stats import byte_length
+from .stylesheet import CompiledStylesheet
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='pynliner', description='Inline CSS into the style attributes of '
+                                     'HTML documents.')
+    parser.add_argument('source', nargs='?', default='-',
+                        help='HTML file or directory of HTML files; '
+                             'default: stdin')
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='output file, or output directory when the '
+                             'source is a directory; default: stdout')
+    parser.add_argument('--css', metavar='FILE', action='append', default=[],
+                        help='CSS applied after the documents\' own, may be '
+                             'given several times')
+    parser.add_argument('--jsonl', action='store_true',
+                        help='read JSON objects with an "html" member from '
+                             'stdin, one per line, and write them to stdout '
+                             'inlined')
+    parser.add_argument('--pattern', default='*.html',
+                        help='file names inlined in a directory; '
+                             'default: %(default)s')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='number of worker processes; default: 1')
+    parser.add_argument('--parser', help='BeautifulSoup parser to use')
+    parser.add_argument('--allow-conditional-comments', action='store_true')
+    return parser
+
+
+class InputError(Exception):
+    """An input the command cannot read, reported on stderr."""
+
+
+def read_text(path):
+    try:
+        with io.open(path, encoding='utf-8') as stream:
+            return stream.read()
+    except UnicodeDecodeError as error:
+        raise InputError('%s: %s' % (path, error))
+
+
+def read_html(path):
+    with io.open(path, 'rb') as stream:
+        return stream.read()
+
+
+def inline_all(sources, css, args):
+    """Yields the output of each HTML string of `sources` in order, on
+    `args.jobs` processes.
+    """
+    if args.jobs > 1:
+        from .parallel import inline_parallel
+        return inline_parallel(
+            sources, css, processes=args.jobs,
+            allow_conditional_comments=args.allow_conditional_comments,
+            parser=args.parser)
+    inliner = Pynliner(allow_conditional_comments=args.allow_conditional_comments,
+                       parser=args.parser)
+    if css is not None:
+        inliner.with_compiled_css(css)
+    return inliner.run_many(sources)
+
+
+def find_documents(directory, pattern):
+    """Returns the paths relative to `directory` of the files below it
+    matching `pattern`, sorted.
+    """
+    paths = []
+    for root, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(fnmatch.filter(filenames, pattern)):
+            paths.append(os.path.relpath(os.path.join(root, filename),
+                                         directory))
+    return paths
+
+
+def run_directory(args, css, totals):
+    paths = find_documents(args.source, args.pattern)
+    sources = (read_html(os.path.join(args.source, path)) for path in paths)
+    for path, output in zip(paths, inline_all(sources, css, args)):
+        target = os.path.join(args.output, path)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        with io.open(target, 'w', encoding='utf-8') as stream:
+            stream.write(output)
+        totals.add(output)
+
+
+def run_jsonl(args, css, totals, stdin, stdout):
+    records = deque()
+
+    def sources():
+        for number, line in enumerate(stdin, 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError as error:
+                    raise InputError('line %d: %s' % (number, error))
+                if not isinstance(record, dict) or 'html' not in record:
+                    raise InputError('line %d: no "html" member' % number)
+                records.append(record)
+                yield record['html']
+
+    for output in inline_all(sources(), css, args):
+        record = records.popleft()
+        record['html'] = output
+        stdout.write(json.dumps(record) + u'\n')
+        stdout.flush()
+        totals.add(output)
+
+
+def run_file(args, css, totals, stdin, stdout):
+    source = stdin.read() if args.source == '-' else read_html(args.source)
+    for output in inline_all([source], css, args):
+        if args.output:
+            with io.open(args.output, 'w', encoding='utf-8') as stream:
+                stream.write(output)
+        else:
+            stdout.write(output)
+        totals.add(output)
+
+
+class Totals(object):
+    """Counts the documents and bytes written since it was created."""
+
+    def __init__(self):
+        self.documents = 0
+        self.bytes_out = 0
+        self.start = default_timer()
+
+    def add(self, output):
+        self.documents += 1
+        self.bytes_out += byte_length(output)
+
+    def summary(self):
+        seconds = max(default_timer() - self.start, 1e-9)
+        return ('pynliner: %d documents, %.1f MB in %.2fs '
+                '(%.1f documents/s, %.2f MB/s)'
+                % (self.documents, self.bytes_out / 1e6, seconds,
+                   self.documents / seconds, self.bytes_out / 1e6 / seconds))
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    """Entry point of the `pynliner` command. Returns the exit status: 1,
+    with a message on stderr, if an input cannot be read.
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if not args.jsonl and os.path.isdir(args.source) and not args.output:
+        parser.error('--output is required when the source is a directory')
+    css = None
+    totals = Totals()
+    try:
+        if args.css:
+            css = CompiledStylesheet(u'\n'.join(read_text(path)
+                                                for path in args.css))
+        if args.jsonl:
+            run_jsonl(args, css, totals, stdin, stdout)
+        elif os.path.isdir(args.source):
+            run_directory(args, css, totals)
+        else:
+            run_file(args, css, totals, stdin, stdout)
+    except InputError as error:
+        stderr.write(u'pynliner: %s\n' % error)
+        return 1
+    stderr.write(totals.summary() + u'\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
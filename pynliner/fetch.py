@@ -0,0 +1,91 @@
+"""
+Fetchers used by Pynliner to download HTML pages and <link> stylesheets.
+
+A fetcher has a `fetch(url)` method returning the response content and a
+`max_workers` attribute bounding how many URLs are fetched at once. Pass one
+as `Pynliner(fetcher=...)`; otherwise `default_fetcher` is used, so its
+cache is shared by every Pynliner object.
+"""
+import time
+
+from six.moves.urllib_error import HTTPError
+from six.moves.urllib_request import Request, urlopen
+
+from .cache import LRUCache
+
+
+class CachedResponse(object):
+
+    __slots__ = ('content', 'etag', 'expires')
+
+    def __init__(self, content, etag, expires):
+        self.content = content
+        self.etag = etag
+        self.expires = expires
+
+
+class Fetcher(object):
+    """
+    Fetches URLs with urllib.
+
+    Responses are cached for `ttl` seconds, after which a response with an
+    ETag is revalidated with If-None-Match instead of being downloaded again.
+    `cache_size` bounds the number of cached URLs; 0 disables the cache.
+    `timeout` is passed to urlopen.
+
+    >>> fetcher = Fetcher(timeout=5, ttl=300)
+    >>> Pynliner(fetcher=fetcher).from_url('http://somewebsite.com/file.html')
+    <Pynliner object at 0x26ac70>
+    """
+
+    def __init__(self, timeout=None, ttl=0, cache_size=256, max_workers=4):
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.cache = LRUCache(maxsize=cache_size) if cache_size else None
+
+    def fetch(self, url):
+        """Returns the response content from the given url
+        """
+        cached = self.cache.get(url) if self.cache is not None else None
+        now = time.time()
+        if cached is not None and cached.expires > now:
+            return cached.content
+        request = Request(url)
+        if cached is not None and cached.etag:
+            request.add_header('If-None-Match', cached.etag)
+        try:
+            response = urlopen(request, timeout=self.timeout)
+        except HTTPError as error:
+            if error.code != 304 or cached is None:
+                raise
+            cached.expires = now + self.ttl
+            return cached.content
+        content = response.read()
+        etag = response.headers.get('ETag')
+        if self.cache is not None and (self.ttl or etag):
+            self.cache[url] = CachedResponse(content, etag, now + self.ttl)
+        return content
+
+
+class DictFetcher(object):
+    """
+    Serves content from a mapping of URL to content instead of the network,
+    e.g. for tests. Unknown URLs raise IOError.
+
+    >>> fetcher = DictFetcher({'http://example.com/a.css': 'h1 {color: red}'})
+    """
+
+    max_workers = 1
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def fetch(self, url):
+        try:
+            return self.responses[url]
+        except KeyError:
+            raise IOError("No response for {}".format(url))
+
+
+default_fetcher = Fetcher()
@@ -0,0 +1,147 @@
+"""
+Serialization of inlined documents in chunks, so large documents can be
+written out without building the whole output as one string.
+"""
+import re
+
+import bs4
+import six
+
+conditional_comment_regex = re.compile(
+    r'(<!--\[if [^\]\n]+\].+?&lt;!\[endif\]-->)')
+
+
+def unescape_conditional_comment(match):
+    """re.sub callback restoring the markup BeautifulSoup escaped inside an
+    Outlook style conditional comment.
+    """
+    return match.group().replace('&gt;', '>').replace('&lt;', '<')
+
+
+def iter_soup(soup, formatter='minimal'):
+    """Yields the serialization of `soup` in chunks, one per start tag, end
+    tag and leaf element or string, which join to `six.text_type(soup)`.
+    """
+    if getattr(soup, 'is_xml', False):
+        # the XML declaration is only added when decoding the whole soup
+        yield six.text_type(soup)
+        return
+    stack = [(iter(soup.contents), None)]
+    while stack:
+        for node in stack[-1][0]:
+            if not isinstance(node, bs4.Tag):
+                yield node.output_ready(formatter)
+            elif any(isinstance(child, bs4.Tag) for child in node.contents):
+                start_tag, end_tag = split_tag(node, formatter)
+                yield start_tag
+                stack.append((iter(node.contents), end_tag))
+                break
+            else:
+                yield node.decode(formatter=formatter)
+        else:
+            end_tag = stack.pop()[1]
+            if end_tag is not None:
+                yield end_tag
+
+
+def split_tag(tag, formatter='minimal'):
+    """Returns the start and end tag of a non-empty `tag` as serialized by
+    BeautifulSoup, by serializing a childless copy of it.
+    """
+    empty = bs4.Tag(name=tag.name, attrs=tag.attrs, prefix=tag.prefix,
+                    namespace=tag.namespace)
+    end_tag = u'</%s%s>' % (tag.prefix + ':' if tag.prefix else '', tag.name)
+    serialized = empty.decode(formatter=formatter)
+    return serialized[:-len(end_tag)], end_tag
+
+
+def coalesce(chunks, size=65536):
+    """Joins consecutive small `chunks` into strings of at least `size`
+    characters, except for the last one.
+    """
+    pending = []
+    length = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield u''.join(pending)
+            pending = []
+            length = 0
+    if pending:
+        yield u''.join(pending)
+
+
+def iter_unescape_conditional_comments(chunks):
+    """Applies `unescape_conditional_comment` to a stream of chunks, as
+    `conditional_comment_regex.sub` would to their concatenation.
+
+    Text is written out as soon as it can't be part of a conditional
+    comment. From a possible comment start it is held back only until the
+    comment ends or the line does, since a comment can't span lines.
+    """
+    start_marker = u'<!--[if '
+    end_marker = u'&lt;![endif]-->'
+    carry = u''
+    held = None  # pieces of text from a possible comment start
+    for chunk in chunks:
+        text = carry + chunk
+        carry = u''
+        while text:
+            if held is None:
+                # matches found now are final, as are unmatched comment
+                # starts followed by the end of their line
+                done = text.rfind(u'\n') + 1
+                for match in conditional_comment_regex.finditer(text, done):
+                    done = match.end()
+                start = text.find(start_marker, done)
+                if start == -1:
+                    # the end may be the beginning of a start marker
+                    cut = max(len(text) - len(start_marker) + 1, done)
+                    if cut:
+                        yield conditional_comment_regex.sub(
+                            unescape_conditional_comment, text[:cut])
+                    carry = text[cut:]
+                    break
+                if start:
+                    yield conditional_comment_regex.sub(
+                        unescape_conditional_comment, text[:start])
+                text = text[start:]
+                held = []
+                size = 0
+                window = u''
+                condition_end = -1
+            # search the new text, plus the end of the held text for markers
+            # split across chunks; offsets are relative to the held text
+            search = window + text
+            base = size - len(window)
+            newline = text.find(u'\n')
+            newline = size + newline if newline != -1 else -1
+            end = -1
+            if condition_end == -1:
+                position = search.find(u']', max(len(start_marker) + 1 - base, 0))
+                if position != -1 and (newline == -1 or base + position < newline):
+                    condition_end = base + position
+            if condition_end != -1:
+                position = search.find(end_marker, max(condition_end + 2 - base, 0))
+                if position != -1 and (newline == -1 or base + position < newline):
+                    end = base + position + len(end_marker)
+            if end == -1 and newline == -1:
+                held.append(text)
+                size += len(text)
+                window = search[-len(end_marker):]
+                break
+            held.append(text)
+            pending = u''.join(held)
+            held = None
+            if end != -1:
+                yield conditional_comment_regex.sub(
+                    unescape_conditional_comment, pending[:end])
+                text = pending[end:]
+            else:
+                yield pending[:newline + 1]
+                text = pending[newline + 1:]
+    if held is not None:
+        yield u''.join(held)
+    if carry:
+        yield carry
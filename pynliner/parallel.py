@@ -0,0 +1,106 @@
+"""
+Inline batches of documents on several processes.
+
+Inlining is CPU bound pure Python, so batches are spread over a
+ProcessPoolExecutor. Each worker compiles the shared stylesheet once, with
+the first chunk it is sent, and then inlines chunks of documents with it.
+
+>>> from pynliner.parallel import inline_parallel
+>>> for output in inline_parallel(documents, css, processes=32):
+...     send(output)
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import multiprocessing
+
+from . import Pynliner
+from .stylesheet import CompiledStylesheet, StylesheetCache
+
+_worker_settings = None
+_worker_inliner = None
+
+
+def _get_worker_inliner(settings):
+    """Returns the Pynliner template used for every chunk of this worker,
+    building it from `settings` the first time they are seen. Settings are
+    sent along with each chunk rather than given to an initializer, which
+    process pools only take from Python 3.7 on.
+    """
+    global _worker_settings, _worker_inliner
+    if settings != _worker_settings:
+        css, allow_conditional_comments, parser = settings
+        inliner = Pynliner(allow_conditional_comments=allow_conditional_comments,
+                           style_cache=StylesheetCache(), parser=parser)
+        if css:
+            inliner.with_compiled_css(CompiledStylesheet(css))
+        _worker_settings, _worker_inliner = settings, inliner
+    return _worker_inliner
+
+
+def _inline_chunk(settings, chunk):
+    return list(_get_worker_inliner(settings).run_many(chunk))
+
+
+def _chunks(sources, chunksize):
+    chunk = []
+    for source in sources:
+        chunk.append(source)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def inline_parallel(sources, css=None, processes=None, chunksize=16,
+                    ordered=True, allow_conditional_comments=False,
+                    parser=None):
+    """Inlines every HTML string of the iterable `sources` with the shared
+    `css` (a CSS string or CompiledStylesheet) on `processes` worker
+    processes, defaulting to one per CPU.
+
+    Documents are sent to the workers in lists of `chunksize`, and only a
+    few chunks per worker are in flight at a time, so `sources` is read
+    lazily. With `ordered` the outputs are yielded in the order of
+    `sources`. Otherwise `(index, output)` pairs are yielded as soon as
+    their chunk is done.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    max_pending = 2 * processes
+    if isinstance(css, CompiledStylesheet):
+        css = css.css_string
+    settings = (css, allow_conditional_comments, parser)
+    chunks = enumerate(_chunks(sources, chunksize))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        if ordered:
+            pending = deque()
+            for number, chunk in chunks:
+                pending.append(executor.submit(_inline_chunk, settings, chunk))
+                if len(pending) >= max_pending:
+                    for output in pending.popleft().result():
+                        yield output
+            while pending:
+                for output in pending.popleft().result():
+                    yield output
+        else:
+            pending = {}
+            for number, chunk in chunks:
+                pending[executor.submit(_inline_chunk, settings, chunk)] = number
+                while len(pending) >= max_pending:
+                    for item in _completed(pending, chunksize):
+                        yield item
+            while pending:
+                for item in _completed(pending, chunksize):
+                    yield item
+
+
+def _completed(pending, chunksize):
+    """Waits for at least one of the `pending` chunk futures, removing the
+    finished ones and yielding `(index, output)` for their documents.
+    """
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        start = pending.pop(future) * chunksize
+        for offset, output in enumerate(future.result()):
+            yield start + offset, output
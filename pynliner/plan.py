@@ -0,0 +1,60 @@
+"""
+Style plans: the styles `Pynliner._apply_styles` computed for a document,
+replayed on documents with the same element structure, such as emails
+personalised from one template, without matching any selector.
+"""
+import hashlib
+
+import bs4
+
+from .cache import LRUCache
+
+
+def get_signature(soup, attributes=()):
+    """
+    Returns ``(signature, elements)``: a digest of the element structure of
+    `soup` and its elements in document order.
+
+    The signature covers everything selectors can match on: the tag, id
+    and classes of each element, the values of the attributes named in
+    `attributes` and the number of element children of each element, which
+    together with document order fixes the shape of the tree. Text, comments
+    and all other attributes are left out, so documents differing only in
+    those share a signature.
+
+    >>> get_signature(BeautifulSoup('<p class="a">Hi <b>you</b></p>'))[0]
+    '5b2f...'
+    """
+    attributes = sorted(attributes)
+    elements = []
+    structure = []
+    for node in [soup] + soup.find_all(True):
+        children = 0
+        for child in node.children:
+            if isinstance(child, bs4.Tag):
+                children += 1
+        if node is soup:
+            structure.append(children)
+            continue
+        elements.append(node)
+        structure.append((node.name, node.get('id'), node.get('class'),
+                          [node.get(attribute) for attribute in attributes],
+                          children))
+    # the repr of strings and lists is unambiguous, so is the digest
+    digest = hashlib.sha1(repr(structure).encode('utf-8'))
+    return digest.hexdigest(), elements
+
+
+class StylePlanCache(LRUCache):
+    """
+    A size bounded cache of style plans keyed by stylesheet digests and
+    document signature, shared by Pynliner objects given it as
+    `plan_cache`. A plan is a list of ``(position, style)`` pairs, where
+    `position` indexes the document's elements in document order and `style`
+    is the cascaded style of that element before its own @style attribute
+    is added.
+
+    >>> plans = StylePlanCache(maxsize=256)
+    >>> for html in personalised_emails:
+    ...     Pynliner(plan_cache=plans).from_string(html).run()
+    """
@@ -12,16 +12,18 @@ select(soup, 'div')
 select(soup, 'div#main ul a')
     - returns a list of links inside a ul inside div#main
 
+compile_selector('div#main ul a').match(el)
+    - True if el is a link inside a ul inside div#main
+
 patched to support multiple class selectors here http://code.google.com/p/soupselect/issues/detail?id=4#c0
 """
 import re
 import bs4
 
-attribute_regex = re.compile('\[(?P<attribute>\w+)(?P<operator>[=~\|\^\$\*]?)=?["\']?(?P<value>[^\]"]*)["\']?\]')
-pseudo_classes_regexes = (
-    re.compile(':(first-child)'),
-    re.compile(':(last-child)')
-)
+from .cache import LRUCache
+
+attribute_regex = re.compile('\[(?P<attribute>[\w-]+)(?P<operator>[=~\|\^\$\*]?)=?["\']?(?P<value>[^\]"]*)["\']?\]')
+nth_regex = re.compile(r'^(?:(?P<a>[+-]?\d*)n)?\s*(?:(?P<sign>[+-])\s*)?(?P<b>\d+)?$')
 
 def get_attribute_checker(operator, attribute, value=''):
     """
@@ -43,39 +45,111 @@ def get_attribute_checker(operator, attribute, value=''):
             or el.get(attribute, '').startswith('%s-' % value),
     }.get(operator, lambda el: el.has_attr(attribute))
 
-def is_white_space(el):
-    if isinstance(el, bs4.NavigableString) and str(el).strip() == '':
-        return True
-    if isinstance(el, bs4.Comment):
-        return True
-    return False
+class MatchContext(object):
+    """
+    State shared while matching selectors against one document: the element
+    children of each parent, computed once per parent, so structural
+    pseudo-classes and sibling combinators don't rescan siblings for every
+    element and rule.
+    """
 
-def is_last_content_node(el):
-    result = False
-    if el is None:
-        result = True
-    elif is_white_space(el):
-        result = is_last_content_node(el.nextSibling)
-    return result
-
-def is_first_content_node(el):
-    result = False
-    if el is None:
-        result = True
-    if is_white_space(el):
-        result = is_first_content_node(el.previousSibling)
-    return result
-        
-def get_pseudo_class_checker(psuedo_class):
-    """
-    Takes a psuedo_class, like "first-child" or "last-child"
-    and returns a function that will check if the element satisfies
-    that psuedo class
+    def __init__(self):
+        self._siblings = {}
+        self._first_matches = {}
+
+    def element_siblings(self, el):
+        """
+        Returns ``(siblings, index)``: the element children of the parent of
+        ``el`` and the position of ``el`` among them.
+        """
+        parent = el.parent
+        if parent is None:
+            return [el], 0
+        entry = self._siblings.get(id(parent))
+        if entry is None:
+            siblings = [child for child in parent.contents
+                        if isinstance(child, bs4.Tag)]
+            indexes = dict((id(child), i) for i, child in enumerate(siblings))
+            # the parent is kept so its id can't be reused while cached
+            entry = self._siblings[id(parent)] = (parent, siblings, indexes)
+        return entry[1], entry[2][id(el)]
+
+    def first_match(self, el, steps, index):
+        """
+        Returns the position of the first element child of the parent of
+        ``el`` matching ``steps[index:]``, or their number if none does.
+        Found once per parent and selector, so a ``~`` combinator resolves
+        every child of a parent in at most one pass over them.
+        """
+        siblings, position = self.element_siblings(el)
+        key = (id(el.parent), id(steps), index)
+        entry = self._first_matches.get(key)
+        if entry is None:
+            first = len(siblings)
+            for i, sibling in enumerate(siblings):
+                if match_steps(sibling, steps, self, index):
+                    first = i
+                    break
+            # the steps are kept so their id can't be reused while cached
+            entry = self._first_matches[key] = (steps, first)
+        return entry[1]
+
+
+def parse_nth(argument):
     """
-    return {
-        'first-child': lambda el: is_first_content_node(getattr(el, 'previousSibling', None)),
-        'last-child': lambda el: is_last_content_node(getattr(el, 'nextSibling', None))
-    }.get(psuedo_class)
+    Parses the ``an+b`` argument of ``:nth-child()``, returning ``(a, b)``.
+    """
+    argument = argument.strip().lower()
+    if argument == 'odd':
+        return 2, 1
+    if argument == 'even':
+        return 2, 0
+    match = nth_regex.match(argument)
+    if not argument or not match:
+        raise ValueError("Invalid :nth-child argument: {}".format(argument))
+    a = match.group('a')
+    if a is None:
+        a = 0
+    elif a in ('', '+', '-'):
+        a = int(a + '1')
+    else:
+        a = int(a)
+    b = int(match.group('b') or 0)
+    if match.group('sign') == '-':
+        b = -b
+    return a, b
+
+def is_nth(position, a, b):
+    """
+    True if the 1-based ``position`` is ``a*n + b`` for some n >= 0.
+    """
+    if a == 0:
+        return position == b
+    n, remainder = divmod(position - b, a)
+    return remainder == 0 and n >= 0
+
+def get_pseudo_class_checker(psuedo_class, argument=None):
+    """
+    Takes a psuedo_class, like "first-child" or "nth-child" with its argument,
+    and returns a function of an element and a MatchContext that will check
+    if the element satisfies that psuedo class
+    """
+    if psuedo_class == 'first-child':
+        return lambda el, context: context.element_siblings(el)[1] == 0
+    if psuedo_class == 'last-child':
+        def is_last_child(el, context):
+            siblings, index = context.element_siblings(el)
+            return index == len(siblings) - 1
+        return is_last_child
+    if psuedo_class == 'only-child':
+        return lambda el, context: len(context.element_siblings(el)[0]) == 1
+    if psuedo_class == 'nth-child' and argument is not None:
+        try:
+            a, b = parse_nth(argument)
+        except ValueError:
+            return None
+        return lambda el, context: is_nth(context.element_siblings(el)[1] + 1, a, b)
+    return None
 
 def get_checker(functions):
     def checker(el):
@@ -86,138 +160,484 @@ def get_checker(functions):
     return checker
 
 
-def select(soup, selector):
+selector_token_regex = re.compile(
+    r'\s*(?P<combinator>[>~+])\s*|(?P<descendant>\s+)'
+    r'|(?P<compound>(?:\[[^\]]*\]|\([^)]*\)|[^\s>~+\[(])+)')
+compound_token_regex = re.compile(
+    r'(?P<tag>^(?:[a-zA-Z0-9]+|\*))'
+    r'|#(?P<id>[\w-]+)'
+    r'|\.(?P<cls>[\w-]+)'
+    r'|(?P<attribute>\[[^\]]*\])'
+    r'|::?(?P<pseudo>[\w-]+)(?:\((?P<argument>[^)]*)\))?')
+
+
+def is_element(el):
     """
-    soup should be a BeautifulSoup instance; selector is a CSS selector 
-    specifying the elements you want to retrieve.
-    """
-    handle_token = True
-    current_context = [(soup, [])]
-    operator = None
-    while selector:
-        if handle_token:
-            # Get the rightmost token
-            handle_token = False
-            match = re.search('([_0-9a-zA-Z-#.:*"\'\[\\]=]+)$', selector)
-            if not match:
-                raise Exception("No match was found for {}. We're done or something is broken".format(selector))
-            token = match.groups(1)[0]
-
-            # remove this token from the selector
-            selector = selector.rsplit(token, 1)[0].rstrip()
-            
-            checker_functions = []
-            #
-            # Get attribute selectors from token
-            #
-            matches = attribute_regex.findall(token)
-            for match in matches:
-                checker_functions.append(get_attribute_checker(match[1], match[0], match[2]))
-
-            #
-            # Get pseudo classes from token
-            #
-            for pseudo_class_regex in pseudo_classes_regexes:
-                match = pseudo_class_regex.search(token)
-                if match:
-                    checker_functions.append(get_pseudo_class_checker(match.groups(1)[0]))
-
-            checker = get_checker(checker_functions)
-            #
-            # Get tag
-            #
-            tag = re.findall('^([a-zA-Z0-9]+)', token)
-            if len(tag) == 0:
-                tag = True
-            elif len(tag) == 1:
-                tag = tag[0]
+    True for tags inside a document; False for strings and for the
+    BeautifulSoup object itself.
+    """
+    return isinstance(el, bs4.Tag) and not isinstance(el, bs4.BeautifulSoup)
+
+def get_classes(el):
+    classes = el.get('class', [])
+    if not isinstance(classes, (list, tuple)):
+        classes = classes.split()
+    return classes
+
+
+class CompoundSelector(object):
+    """
+    A single compound selector such as ``p.note[title]:first-child``: a tag,
+    ids, classes and extra checks that must all hold for one element.
+    """
+
+    def __init__(self, token):
+        self.tag = None
+        self.ids = []
+        self.classes = []
+        self.attributes = []
+        checker_functions = []
+        self.pseudo_checkers = []
+        position = 0
+        while position < len(token):
+            match = compound_token_regex.match(token, position)
+            if not match or match.end() == position:
+                raise ValueError("Invalid selector token: {}".format(token))
+            position = match.end()
+            if match.group('tag'):
+                if match.group('tag') != '*':
+                    self.tag = match.group('tag')
+            elif match.group('id'):
+                self.ids.append(match.group('id'))
+            elif match.group('cls'):
+                self.classes.append(match.group('cls'))
+            elif match.group('attribute'):
+                attribute = attribute_regex.match(match.group('attribute'))
+                if not attribute:
+                    raise ValueError("Invalid attribute selector: {}".format(token))
+                self.attributes.append(attribute.group('attribute'))
+                checker_functions.append(get_attribute_checker(
+                    attribute.group('operator'), attribute.group('attribute'),
+                    attribute.group('value')))
             else:
-                raise Exception("Multiple tags found (invalid CSS)")
-
-            #
-            # Get ID
-            #
-            ids = re.findall('#([a-zA-Z0-9_-]+)', token)
-            if len(ids) > 1:
-                raise Exception("Only single # OK")
-            #
-            # Get classes
-            #
-            classes = re.findall('\.([a-zA-Z0-9_-]+)', token)
-
-            #
-            # Search contexts for matches
-            #
-            found = []
-            find_dict = {}
-            if ids:
-                find_dict['id'] = ids
-            if classes:
-                find_dict['class'] = lambda attr: attr and set(classes).issubset(attr.split())
-            if operator is None:
-                # This is the first token: simply find all matches
-                for context in current_context:
-                    context_matches = [el for el in context[0].findAll(tag, find_dict) if checker(el)]
-                    for context_match in context_matches:
-                        found.append(
-                            (context_match, [context_match]),
-                        )
-            elif operator == ' ':
-                # for each context in current_context, ensure there
-                # exists an element somewhere above that element that
-                # matches the provided token
-                # ("descendant" selector)
-                for context in current_context:
-                    context_matches = []
-                    for el in context[1]:
-                        if checker(el.findParent(tag, find_dict)):
-                            context_matches.append(el)
-                    if context_matches:
-                        found.append(
-                            (context[0], context_matches),
-                        )
-            elif operator == '>':
-                # for each context in current_context,
-                # check if the parent satisfies the provided
-                # arguments.
-                for context in current_context:
-                    context_matches = []
-                    for el in context[1]:
-                        if checker(el.findParent(tag, find_dict)) == el.parent:
-                            context_matches.append(el.parent)
-                    if context_matches:
-                        found.append(
-                            (context[0], context_matches),
-                        )
-            elif operator == '~':
-                # for each context in current_context
-                # check 
-                raise NotImplementedError("~ operator is not implemented. Sad face :(")
-            elif operator == '+':
-                # for each context in current_context
-                # check if the preceding sibling satisfies the
-                # provided arguments
-                for context in current_context:
-                    context_matches = []
-                    for el in context[1]:
-                        if checker(el.findPreviousSibling(tag, find_dict)) == el.previousSibling:
-                            context_matches.append(el.previousSibling)
-                    if context_matches:
-                        found.append(
-                            (context[0], context_matches)
-                        )
-            current_context = found
+                self.pseudo_checkers.append(
+                    get_pseudo_class_checker(match.group('pseudo'),
+                                             match.group('argument'))
+                    or (lambda el, context: False))
+        self.checker = get_checker(checker_functions)
+
+    @property
+    def tokens(self):
+        """The tag, ids and classes in the form used by `element_tokens`.
+        """
+        tokens = ['#' + id_ for id_ in self.ids]
+        tokens += ['.' + class_ for class_ in self.classes]
+        if self.tag is not None:
+            tokens.append(self.tag)
+        return tokens
+
+    def match(self, el, context):
+        if self.tag is not None and el.name != self.tag:
+            return False
+        for id_ in self.ids:
+            if el.get('id') != id_:
+                return False
+        if self.classes:
+            classes = get_classes(el)
+            for class_ in self.classes:
+                if class_ not in classes:
+                    return False
+        if not self.checker(el):
+            return False
+        for checker in self.pseudo_checkers:
+            if not checker(el, context):
+                return False
+        return True
+
+
+def parse_selector(selector):
+    """
+    Splits a selector into a list of ``(compound, combinator)`` steps ordered
+    right to left: the first step matches the element itself and each
+    combinator says how the next step relates to the previous one.
+    """
+    compounds = []
+    combinators = []
+    position = 0
+    selector = selector.strip()
+    while position < len(selector):
+        match = selector_token_regex.match(selector, position)
+        if not match:
+            raise ValueError("Invalid selector: {}".format(selector))
+        position = match.end()
+        if match.group('compound'):
+            if len(compounds) > len(combinators):
+                raise ValueError("Invalid selector: {}".format(selector))
+            compounds.append(CompoundSelector(match.group('compound')))
         else:
-            # Get the next operator (whitespace, >, ~, +)
-            handle_token = True
-            operator = None
-            match = re.search('([>~+]+)$', selector)
-            if match:
-                operator = match.groups(1)[0]
+            combinator = match.group('combinator') or ' '
+            if len(combinators) >= len(compounds):
+                raise ValueError("Invalid selector: {}".format(selector))
+            combinators.append(combinator)
+    if not compounds or len(combinators) >= len(compounds):
+        raise ValueError("Invalid selector: {}".format(selector))
+    combinators.insert(0, None)
+    return list(reversed(list(zip(compounds, combinators))))
+
+
+def element_tokens(el):
+    """
+    Returns the tag name, ``#id`` and ``.class`` tokens of an element.
+    """
+    tokens = [el.name]
+    id_ = el.get('id')
+    if id_ is not None:
+        tokens.append('#' + id_)
+    tokens += ['.' + class_ for class_ in set(get_classes(el))]
+    return tokens
+
+
+class AncestorFilter(object):
+    """
+    The tokens of the ancestors of the element currently visited by a depth
+    first walk, as browsers keep with an ancestor Bloom filter. Counting
+    exact tokens in a dict is cheaper than hashing into bits in Python and
+    has no false positives.
+    """
+
+    def __init__(self):
+        self.counts = {}
+
+    def push(self, tokens):
+        counts = self.counts
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+
+    def pop(self, tokens):
+        counts = self.counts
+        for token in tokens:
+            if counts[token] == 1:
+                del counts[token]
             else:
-                operator = ' '
-            selector = selector.rsplit(operator, 1)[0].rstrip()
-    return [entry[0] for entry in current_context]
+                counts[token] -= 1
+
+    def may_match(self, tokens):
+        """
+        False if some token is on no ancestor, in which case a selector
+        requiring these ancestor tokens cannot match.
+        """
+        counts = self.counts
+        for token in tokens:
+            if token not in counts:
+                return False
+        return True
+
+
+def walk(soup):
+    """
+    Yields ``(element, ancestors)`` for every element below ``soup`` in
+    document order, where ``ancestors`` is an AncestorFilter holding the
+    tokens of the element's ancestors at the time it is yielded.
+    """
+    ancestors = AncestorFilter()
+    stack = [iter(soup.contents)]
+    pushed = []
+    while stack:
+        for node in stack[-1]:
+            if isinstance(node, bs4.Tag):
+                yield node, ancestors
+                if node.contents:
+                    tokens = element_tokens(node)
+                    ancestors.push(tokens)
+                    pushed.append(tokens)
+                    stack.append(iter(node.contents))
+                    break
+        else:
+            stack.pop()
+            if pushed:
+                ancestors.pop(pushed.pop())
+
+
+def match_steps(el, steps, context, index=0):
+    """
+    True if ``el`` matches ``steps[index:]`` as returned by `parse_selector`.
+    """
+    compound, combinator = steps[index]
+    if not compound.match(el, context):
+        return False
+    if combinator is None:
+        return True
+    if combinator == '>':
+        parent = el.parent
+        return is_element(parent) and \
+            match_steps(parent, steps, context, index + 1)
+    if combinator == ' ':
+        for parent in el.parents:
+            if is_element(parent) and \
+                    match_steps(parent, steps, context, index + 1):
+                return True
+        return False
+    if combinator == '+':
+        siblings, position = context.element_siblings(el)
+        return position > 0 and \
+            match_steps(siblings[position - 1], steps, context, index + 1)
+    if combinator == '~':
+        siblings, position = context.element_siblings(el)
+        return context.first_match(el, steps, index + 1) < position
+    return False
+
+
+class CompiledSelector(object):
+    """
+    A parsed selector that can be matched against any number of elements.
+    Use `compile_selector` to get one.
+    """
+
+    def __init__(self, selector):
+        self.selector = selector
+        self.steps = parse_selector(selector)
+        # tokens that must be present on some ancestor of a matching element:
+        # those of every compound reached through a descendant or child
+        # combinator. A compound reached through a sibling combinator ("+" or
+        # "~") is a sibling of the subject or of an ancestor, not an ancestor,
+        # but the ancestors of that sibling are ancestors of the subject too.
+        self.ancestor_tokens = []
+        combinator = None
+        for compound, next_combinator in self.steps:
+            if combinator in (' ', '>'):
+                self.ancestor_tokens += compound.tokens
+            combinator = next_combinator
+        # every compound must match some element of the document
+        self.required_tokens = set()
+        # names of the attributes tested by attribute selectors
+        self.attributes = set()
+        for compound, combinator in self.steps:
+            self.required_tokens.update(compound.tokens)
+            self.attributes.update(compound.attributes)
+
+    def __repr__(self):
+        return '<CompiledSelector {!r}>'.format(self.selector)
+
+    @property
+    def subject(self):
+        """The rightmost compound selector, which matches the element itself.
+        """
+        return self.steps[0][0]
+
+    def match(self, el, context=None):
+        """
+        True if ``el`` matches the selector. Pass the same MatchContext when
+        matching many elements of one document to share its caches.
+        """
+        if context is None:
+            context = MatchContext()
+        return match_steps(el, self.steps, context)
+
+    def select(self, soup, index=None):
+        """
+        Returns every element below `soup` matching the selector, in document
+        order. If given, `index` must be a DocumentIndex of `soup`; candidates
+        are then looked up in it instead of walking the tree.
+        """
+        if index is not None:
+            elements = index.candidates(self.subject)
+        else:
+            elements = soup.find_all(True)
+        context = MatchContext()
+        return [el for el in elements if self.match(el, context)]
+
+
+_selector_cache = LRUCache(maxsize=1024)
+
+def compile_selector(selector):
+    """
+    Returns a CompiledSelector for `selector`. Compiled selectors are kept in a
+    bounded LRU cache keyed by the selector text, so each distinct selector is
+    parsed once per process.
+    """
+    compiled = _selector_cache.get(selector)
+    if compiled is None:
+        compiled = _selector_cache[selector] = CompiledSelector(selector)
+    return compiled
+
+
+class DocumentIndex(object):
+    """
+    Maps tag names, ids and class tokens to the elements of a document
+    having them, built in a single walk. Each posting list, like `elements`,
+    is in document order.
+    """
+
+    def __init__(self, soup):
+        self.elements = soup.find_all(True)
+        self.by_tag = {}
+        self.by_id = {}
+        self.by_class = {}
+        for el in self.elements:
+            self.by_tag.setdefault(el.name, []).append(el)
+            id_ = el.get('id')
+            if id_ is not None:
+                self.by_id.setdefault(id_, []).append(el)
+            for class_ in set(get_classes(el)):
+                self.by_class.setdefault(class_, []).append(el)
+        # all tokens present in the document, as given by `element_tokens`
+        self.tokens = set(self.by_tag)
+        self.tokens.update('#' + id_ for id_ in self.by_id)
+        self.tokens.update('.' + class_ for class_ in self.by_class)
+
+    def candidates(self, compound):
+        """
+        Returns the elements having the tag, ids and classes of `compound`,
+        in document order, by intersecting their posting lists.
+        """
+        postings = []
+        if compound.tag is not None:
+            postings.append(self.by_tag.get(compound.tag, []))
+        for id_ in compound.ids:
+            postings.append(self.by_id.get(id_, []))
+        for class_ in compound.classes:
+            postings.append(self.by_class.get(class_, []))
+        if not postings:
+            return self.elements
+        postings.sort(key=len)
+        result = postings[0]
+        for posting in postings[1:]:
+            if not result:
+                break
+            keep = set(map(id, posting))
+            result = [el for el in result if id(el) in keep]
+        return result
+
+
+class SelectorSet(object):
+    """
+    A collection of selectors, each with attached data, that is matched
+    against a whole document in one walk.
+
+    Selectors are bucketed by the id, first class or tag of their rightmost
+    compound so each element is only tested against selectors that could
+    possibly match it.
+    """
+
+    def __init__(self):
+        self._count = 0
+        self._by_id = {}
+        self._by_class = {}
+        self._by_tag = {}
+        self._universal = []
+
+    def __len__(self):
+        return self._count
+
+    def add(self, selector, data=None):
+        self._add_entry((self._count, compile_selector(selector), data))
+
+    def _add_entry(self, entry):
+        self._count += 1
+        compound = entry[1].subject
+        if compound.ids:
+            self._by_id.setdefault(compound.ids[0], []).append(entry)
+        elif compound.classes:
+            self._by_class.setdefault(compound.classes[0], []).append(entry)
+        elif compound.tag is not None:
+            self._by_tag.setdefault(compound.tag, []).append(entry)
+        else:
+            self._universal.append(entry)
+
+    def entries(self):
+        """
+        Returns the ``(order, compiled, data)`` entries of the set in the
+        order they were added.
+        """
+        entries = list(self._universal)
+        for buckets in (self._by_id, self._by_class, self._by_tag):
+            for bucket in buckets.values():
+                entries += bucket
+        entries.sort(key=lambda entry: entry[0])
+        return entries
+
+    def filtered(self, index):
+        """
+        Returns a SelectorSet holding only the selectors that can match in the
+        document of the DocumentIndex ``index``: a selector needing a tag, id
+        or class the document does not have is dropped before any matching.
+        """
+        tokens = index.tokens
+        selectors = SelectorSet()
+        for entry in self.entries():
+            if entry[1].required_tokens <= tokens:
+                selectors._add_entry(entry)
+        return selectors
+
+    def candidates(self, el):
+        """
+        Returns the entries whose rightmost compound could match ``el``, in
+        the order they were added.
+        """
+        candidates = list(self._universal)
+        candidates += self._by_tag.get(el.name, [])
+        id_ = el.get('id')
+        if id_ is not None:
+            candidates += self._by_id.get(id_, [])
+        for class_ in set(get_classes(el)):
+            candidates += self._by_class.get(class_, [])
+        candidates.sort(key=lambda entry: entry[0])
+        return candidates
+
+    def match(self, el, ancestors=None, stats=None, context=None):
+        """
+        Returns the data of every selector matching ``el``, in the order the
+        selectors were added. With the AncestorFilter of ``el``, selectors
+        needing a token no ancestor has are rejected without walking up.
+        If given, ``stats.selectors_evaluated`` counts the selectors fully
+        matched against ``el``.
+        """
+        if context is None:
+            context = MatchContext()
+        matched = []
+        evaluated = 0
+        for order, compiled, data in self.candidates(el):
+            if ancestors is not None and \
+                    not ancestors.may_match(compiled.ancestor_tokens):
+                continue
+            evaluated += 1
+            if compiled.match(el, context):
+                matched.append(data)
+        if stats is not None:
+            stats.selectors_evaluated += evaluated
+        return matched
+
+    def select(self, soup):
+        """
+        Walks ``soup`` once, yielding ``(element, data_list)`` for each
+        element matched by at least one selector, in document order.
+        """
+        return match_sets(soup, [self])
+
+
+def match_sets(soup, selector_sets, stats=None):
+    """
+    Walks ``soup`` once, depth first, yielding ``(element, data_list)`` for
+    each element matched by at least one selector of any of
+    ``selector_sets``. The data of each set is listed after the data of the
+    sets before it. ``stats`` is passed on to `SelectorSet.match`.
+    """
+    context = MatchContext()
+    for el, ancestors in walk(soup):
+        matched = []
+        for selector_set in selector_sets:
+            matched += selector_set.match(el, ancestors, stats, context)
+        if matched:
+            yield el, matched
+
+
+def select(soup, selector, index=None):
+    """
+    soup should be a BeautifulSoup instance; selector is a CSS selector 
+    specifying the elements you want to retrieve. index may be a
+    DocumentIndex of soup to look candidates up in.
+    """
+    return compile_selector(selector).select(soup, index)
 
 def monkeypatch(BeautifulSoupClass=None):
     """
@@ -0,0 +1,62 @@
+"""
+Instrumentation of Pynliner runs.
+"""
+import six
+
+
+class InlineStats(object):
+    """
+    Timings and counters recorded by Pynliner runs. Pass one as
+    `Pynliner(stats=...)` to accumulate over every run it is given to, or
+    pass a callable to receive a fresh InlineStats after each run.
+
+    `stage_times` maps each stage of `Pynliner.run` (get_soup, get_styles,
+    get_index, apply_styles, get_output and clean_output) to the seconds
+    spent in it. Times and counters are summed over runs. `cache_hits` and
+    `cache_misses` count `style_cache` lookups, `result_hits` and
+    `result_misses` count `result_cache` lookups, `plan_hits` and
+    `plan_misses` count `plan_cache` lookups.
+
+    >>> stats = InlineStats()
+    >>> Pynliner(stats=stats).from_string(html).run()
+    >>> stats.as_dict()
+    {'runs': 1, 'rules': 12, 'stage_times': {'get_soup': 0.0012, ...}, ...}
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.stage_times = {}
+        self.rules = 0
+        self.selectors_evaluated = 0
+        self.elements_matched = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.result_hits = 0
+        self.result_misses = 0
+        self.plan_hits = 0
+        self.plan_misses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.fetches = 0
+        self.fetch_time = 0.0
+
+    def __repr__(self):
+        return '<InlineStats {!r}>'.format(self.as_dict())
+
+    def add_time(self, stage, seconds):
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+
+    def as_dict(self):
+        """Returns the timings and counters as a plain dict, e.g. to export
+        them to a metrics system.
+        """
+        result = dict(self.__dict__)
+        result['stage_times'] = dict(self.stage_times)
+        return result
+
+
+def byte_length(string):
+    """Returns the length in bytes of `string`, encoding text as UTF-8."""
+    if isinstance(string, six.text_type):
+        return len(string.encode('utf-8'))
+    return len(string)
@@ -0,0 +1,142 @@
+"""
+Stylesheets parsed and compiled ahead of time so they can be applied to any
+number of documents.
+"""
+from collections import OrderedDict
+import hashlib
+
+import cssutils
+import six
+
+from .cache import LRUCache
+from .soupselect import SelectorSet, compile_selector
+
+
+class CompiledRule(object):
+    """A style rule reduced to what is needed to apply it to elements."""
+
+    __slots__ = ('selector_text', 'properties')
+
+    def __init__(self, selector_text, properties):
+        self.selector_text = selector_text
+        self.properties = properties
+
+    def __repr__(self):
+        return '<CompiledRule {!r}>'.format(self.selector_text)
+
+
+class Cascade(object):
+    """
+    The declarations applying to one element. Rules are applied in ascending
+    cascade order and a later declaration of a property replaces the earlier
+    one, moving to the end.
+
+    >>> cascade = Cascade()
+    >>> cascade.apply(rule)
+    >>> cascade.serialize()
+    u'color: red; margin: 0'
+    """
+
+    __slots__ = ('declarations',)
+
+    def __init__(self):
+        self.declarations = OrderedDict()
+
+    def apply(self, rule):
+        declarations = self.declarations
+        for name, value in rule.properties:
+            declarations.pop(name, None)
+            declarations[name] = value
+
+    def serialize(self):
+        """Returns the declarations formatted the way cssutils serializes a
+        CSSStyleDeclaration on one line.
+        """
+        return u'; '.join([u'%s: %s' % item for item in self.declarations.items()])
+
+
+def css_digest(css_string):
+    """Returns the SHA-1 hex digest of `css_string`, encoding text as UTF-8.
+    """
+    if isinstance(css_string, six.text_type):
+        css_string = css_string.encode('utf-8')
+    return hashlib.sha1(css_string).hexdigest()
+
+
+class CompiledStylesheet(object):
+    """
+    A CSS string parsed with cssutils once, with its selectors compiled and
+    each rule's properties precomputed.
+
+    `selectors` maps every selector to ``(specificity, rule)``, where
+    `specificity` is the selector's own specificity as a comparable tuple
+    ('h1, .a' => (0, 0, 0, 1) and (0, 0, 1, 0)).
+
+    >>> css = CompiledStylesheet('h1 { color: #fc0; }')
+    >>> Pynliner(stylesheet=css).from_string('<h1>Hi</h1>').run()
+    u'<h1 style="color: #fc0">Hi</h1>'
+    """
+
+    def __init__(self, css_string, log=None):
+        self._compile(css_string, log)
+
+    def __getstate__(self):
+        # parsed rules and compiled selectors hold closures, so pickles carry
+        # the CSS text and are compiled again when loaded
+        return {'css_string': self.css_string}
+
+    def __setstate__(self, state):
+        self._compile(state['css_string'])
+
+    def _compile(self, css_string, log=None):
+        self.css_string = css_string
+        self.digest = css_digest(css_string)
+        cssparser = cssutils.CSSParser(log=log)
+        self.sheet = cssparser.parseString(css_string)
+        self.rules = []
+        self.selectors = SelectorSet()
+        # attributes tested by attribute selectors, see `plan.get_signature`
+        self.attributes = set()
+        for rule in self.sheet.cssRules.rulesOfType(1):
+            try:
+                compiled = [(compile_selector(selector.selectorText),
+                             tuple(selector.specificity))
+                            for selector in rule.selectorList]
+            except ValueError as error:
+                # like a browser, drop a rule with a selector we can't parse
+                # and carry on with the rest of the stylesheet
+                if log is not None:
+                    log.warning('Skipped rule %r: %s', rule.selectorText, error)
+                continue
+            compiled_rule = CompiledRule(
+                rule.selectorText,
+                [(prop.name, prop.value) for prop in rule.style.getProperties()])
+            self.rules.append(compiled_rule)
+            for selector, specificity in compiled:
+                self.selectors.add(selector.selector,
+                                   (specificity, compiled_rule))
+                self.attributes.update(selector.attributes)
+
+    def __repr__(self):
+        return '<CompiledStylesheet with {} rules>'.format(len(self.rules))
+
+
+class StylesheetCache(LRUCache):
+    """
+    A size bounded cache of CompiledStylesheets keyed by a hash of their CSS
+    text, so byte-identical CSS is only parsed once. `hits` and `misses`
+    count lookups.
+
+    >>> cache = StylesheetCache(maxsize=64)
+    >>> Pynliner(style_cache=cache).from_string(html).run()
+    """
+
+    def compile(self, css_string, log=None):
+        """Returns the cached CompiledStylesheet for `css_string`, compiling
+        and caching it first if needed.
+        """
+        key = css_digest(css_string)
+        stylesheet = self.get(key)
+        if stylesheet is None:
+            stylesheet = self[key] = CompiledStylesheet(css_string, log=log)
+        return stylesheet
@@ -19,7 +19,11 @@ setup(name='pynliner',
       install_requires=[
           'BeautifulSoup4 >= 4.4.1',
           'cssutils >=0.9.7',
+          'futures; python_version < "3"',
           'mock',
           'six'
       ],
+      entry_points={
+          'console_scripts': ['pynliner = pynliner.cli:main'],
+      },
       provides=['pynliner'])
@@ -4,10 +4,33 @@
 import unittest
 import pynliner
 import io
+import json
 import logging
+import os
 import cssutils
 import mock
-from pynliner import Pynliner
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+from bs4 import BeautifulSoup
+from pynliner import Pynliner, cli
+from six.moves.urllib_error import HTTPError
+from pynliner.cache import DiskResultCache, LRUCache, MemoryResultCache
+from pynliner.fetch import DictFetcher, Fetcher
+from pynliner import parallel
+from pynliner.parallel import inline_parallel
+from pynliner.plan import StylePlanCache, get_signature
+try:
+    import lxml
+except ImportError:
+    lxml = None
+if sys.version_info >= (3, 5):
+    # kept in a module of its own so that this one compiles on Python 2
+    from tests_aio import Async
+from pynliner.soupselect import (DocumentIndex, MatchContext, SelectorSet, compile_selector,
+                                 match_sets, parse_nth, select, walk)
 
 
 class Basic(unittest.TestCase):
@@ -120,6 +143,52 @@ class Basic(unittest.TestCase):
         output = Pynliner().from_string(html).with_cssString(css).run()
         self.assertEqual(output, expected)
 
+    def test_many_classes_do_not_beat_an_id(self):
+        classes = ' '.join('c%d' % i for i in range(11))
+        html = '<h1 id="test" class="%s">Hello world!</h1>' % classes
+        css = '#test { color: blue; } %s { color: red; }' % ''.join('.c%d' % i for i in range(11))
+        expected = '<h1 class="%s" id="test" style="color: blue">Hello world!</h1>' % classes
+        output = Pynliner().from_string(html).with_cssString(css).run()
+        self.assertEqual(expected, output)
+
+    def test_selector_specificity(self):
+        css = pynliner.CompiledStylesheet('h1, .a { color: red; } #b { color: blue; }')
+        self.assertEqual([data[0] for order, compiled, data in css.selectors.entries()],
+                         [(0, 0, 0, 1), (0, 0, 1, 0), (0, 1, 0, 0)])
+
+    def test_comma_selectors_do_not_add_up(self):
+        html = '<p class="a c">Hi</p>'
+        css = '.a, .b { color: red; } .c { color: blue; }'
+        output = Pynliner().from_string(html).with_cssString(css).run()
+        self.assertEqual(output, '<p class="a c" style="color: blue">Hi</p>')
+
+    def test_most_specific_matching_selector_counts(self):
+        html = '<p class="a" id="z">Hi</p>'
+        css = '.a, #q { color: red; } p.a.a { color: blue; } .x, #z { margin: 0; } #z { margin: 1px; }'
+        output = Pynliner().from_string(html).with_cssString(css).run()
+        self.assertEqual(output, '<p class="a" id="z" style="color: blue; margin: 1px">Hi</p>')
+
+
+class Parsers(unittest.TestCase):
+    def setUp(self):
+        self.html = '<style>h1 { color: red; }</style><h1>Hello</h1><p>World'
+
+    def test_explicit_parser(self):
+        output = Pynliner(parser='html.parser').from_string(self.html).run()
+        self.assertEqual(output, u'<h1 style="color: red">Hello</h1><p>World</p>')
+
+    @unittest.skipUnless(lxml, 'lxml is not installed')
+    def test_lxml_parser(self):
+        output = Pynliner(parser='lxml').from_string(self.html).run()
+        self.assertEqual(output, u'<html><head></head><body><h1 style="color: red">Hello</h1>'
+                                 u'<p>World</p></body></html>')
+
+    def test_default_parser_detected_once(self):
+        with mock.patch.object(pynliner, '_default_parser', False):
+            with mock.patch.dict('sys.modules', {'mod_wsgi': mock.Mock(version=(4, 0))}):
+                self.assertEqual(pynliner.get_default_parser(), 'html5lib')
+            self.assertEqual(pynliner.get_default_parser(), 'html5lib')
+
 
 class ExternalStyles(unittest.TestCase):
     def setUp(self):
@@ -159,6 +228,161 @@ class ExternalStyles(unittest.TestCase):
         self._test_external_url('//other.com/something/test.css', 'http://other.com/something/test.css')
 
 
+class StreamingOutput(unittest.TestCase):
+    def setUp(self):
+        self.html = ('<!DOCTYPE html><html><head><style>p { color: red; }</style></head>'
+                     '<body><div class="a"><p>1 &lt; 2</p><br/><p>two<b>x</b></p></div>'
+                     '<script>if (a < b) {}</script><!-- note --></body></html>')
+
+    def test_iter_output_matches_run(self):
+        expected = Pynliner().from_string(self.html).run()
+        chunks = list(Pynliner().from_string(self.html).iter_output(chunk_size=10))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(u''.join(chunks), expected)
+
+    def test_run_to(self):
+        stream = io.StringIO()
+        Pynliner().from_string(self.html).run_to(stream)
+        self.assertEqual(stream.getvalue(), Pynliner().from_string(self.html).run())
+
+    def test_conditional_comments_across_chunks(self):
+        comment = '<!--[if mso]>&lt;table&gt;&lt;![endif]-->'
+        chunks = [comment[:7], comment[7:] + '\n' + comment[:3], comment[3:], ' tail']
+        unescaped = '<!--[if mso]><table><![endif]-->'
+        self.assertEqual(u''.join(pynliner.output.iter_unescape_conditional_comments(chunks)),
+                         unescaped + '\n' + unescaped + ' tail')
+        self.assertEqual(u''.join(pynliner.output.iter_unescape_conditional_comments(
+            [u'no comments here'])), u'no comments here')
+
+
+    def test_conditional_comments_without_newlines(self):
+        comment = u'<!--[if mso]>&lt;br&gt;&lt;![endif]-->'
+        consumed = []
+
+        def chunks():
+            for i in range(1000):
+                consumed.append(i)
+                yield u'<p>%d</p>%s' % (i, comment)
+
+        outputs = pynliner.output.iter_unescape_conditional_comments(chunks())
+        first = next(outputs)
+        # written as soon as the first comment closed, not at the end
+        self.assertEqual(len(consumed), 1)
+        self.assertEqual(first + u''.join(outputs),
+                         u''.join(u'<p>%d</p><!--[if mso]><br><![endif]-->' % i
+                                  for i in range(1000)))
+
+    def test_iter_unescape_matches_clean_output(self):
+        comment = u'<!--[if mso]>&lt;td&gt;&lt;![endif]-->'
+        output = u'<p>1 &lt; 2</p>%s x &lt;y&gt; %s\n<!--[if mso]>&lt;b&gt;' % (comment, comment)
+        p = Pynliner(allow_conditional_comments=True)
+        p.output = output
+        p._clean_output()
+        self.assertIn(u' x &lt;y&gt; ', p.output)
+        for size in (1, 5, 16):
+            chunks = [output[i:i + size] for i in range(0, len(output), size)]
+            self.assertEqual(u''.join(
+                pynliner.output.iter_unescape_conditional_comments(chunks)), p.output)
+
+class ConditionalComments(unittest.TestCase):
+    def test_clean_output_restores_every_comment(self):
+        escaped = '<!--[if mso]>&lt;table&gt;&lt;![endif]-->'
+        unescaped = '<!--[if mso]><table><![endif]-->'
+        p = Pynliner(allow_conditional_comments=True)
+        p.output = u'<p>a</p>%s<p>b</p>%s<p>c</p>' % (escaped, escaped)
+        p._clean_output()
+        self.assertEqual(p.output, u'<p>a</p>%s<p>b</p>%s<p>c</p>' % (unescaped, unescaped))
+
+    def test_clean_output_disabled(self):
+        p = Pynliner()
+        p.output = u'<!--[if mso]>&lt;table&gt;&lt;![endif]-->'
+        p._clean_output()
+        self.assertEqual(p.output, u'<!--[if mso]>&lt;table&gt;&lt;![endif]-->')
+
+
+class Stats(unittest.TestCase):
+    def setUp(self):
+        self.html = ('<link rel="stylesheet" href="a.css"/>'
+                     '<style>h1 { color: red; } p { color: blue; }</style>'
+                     '<h1>Hi</h1><p>One</p><p class="x">Two</p>')
+        self.fetcher = DictFetcher({'http://server.com/a.css': '.x { margin: 0; }'})
+
+    def _inliner(self, stats, **kwargs):
+        p = Pynliner(stats=stats, fetcher=self.fetcher, **kwargs).from_string(self.html)
+        p.root_url = 'http://server.com'
+        return p
+
+    def test_stats_object(self):
+        stats = pynliner.InlineStats()
+        output = self._inliner(stats).run()
+        self.assertEqual(sorted(stats.stage_times), [
+            'apply_styles', 'clean_output', 'get_index', 'get_output',
+            'get_soup', 'get_styles'])
+        self.assertEqual(stats.runs, 1)
+        self.assertEqual(stats.rules, 3)
+        self.assertEqual(stats.elements_matched, 3)
+        self.assertEqual(stats.selectors_evaluated, 4)
+        self.assertEqual(stats.fetches, 1)
+        self.assertEqual(stats.bytes_in, len(self.html))
+        self.assertEqual(stats.bytes_out, len(output))
+
+    def test_stats_callback(self):
+        received = []
+        cache = pynliner.StylesheetCache()
+        for _ in range(2):
+            self._inliner(received.append, style_cache=cache).run()
+        self.assertEqual([(stats.runs, stats.cache_hits, stats.cache_misses)
+                          for stats in received], [(1, 0, 1), (1, 1, 0)])
+
+    def test_iter_output_stats(self):
+        stats = pynliner.InlineStats()
+        output = u''.join(self._inliner(stats).iter_output())
+        self.assertEqual(stats.bytes_out, len(output))
+        self.assertIn('apply_styles', stats.as_dict()['stage_times'])
+
+
+class Fetchers(unittest.TestCase):
+    def test_links_fetched_in_document_order(self):
+        fetcher = DictFetcher({
+            'http://server.com/a.css': 'h1 { color: red; }',
+            'http://server.com/b.css': b'h1 { color: blue; }',
+            'http://server.com/c.css': 'p { color: green; }',
+        })
+        html = ('<link rel="stylesheet" href="a.css"/><link rel="stylesheet" href="b.css"/>'
+                '<link rel="stylesheet" href="c.css"/><h1>Hi</h1><p>There</p>')
+        p = Pynliner(fetcher=fetcher).from_string(html)
+        p.root_url = 'http://server.com'
+        self.assertEqual(p.run(), u'<h1 style="color: blue">Hi</h1><p style="color: green">There</p>')
+
+    def test_dict_fetcher_unknown_url(self):
+        self.assertRaises(IOError, DictFetcher({}).fetch, 'http://server.com/a.css')
+
+    def _response(self, content, etag=None):
+        response = mock.Mock()
+        response.read.return_value = content
+        response.headers = {'ETag': etag} if etag else {}
+        return response
+
+    def test_ttl_cache(self):
+        fetcher = Fetcher(ttl=60)
+        with mock.patch('pynliner.fetch.urlopen') as urlopen:
+            urlopen.return_value = self._response(b'h1 {}')
+            self.assertEqual(fetcher.fetch('http://server.com/a.css'), b'h1 {}')
+            self.assertEqual(fetcher.fetch('http://server.com/a.css'), b'h1 {}')
+        self.assertEqual(urlopen.call_count, 1)
+
+    def test_etag_revalidation(self):
+        fetcher = Fetcher(timeout=3)
+        with mock.patch('pynliner.fetch.urlopen') as urlopen:
+            urlopen.return_value = self._response(b'h1 {}', etag='"v1"')
+            fetcher.fetch('http://server.com/a.css')
+            urlopen.side_effect = HTTPError('http://server.com/a.css', 304, 'Not Modified', {}, None)
+            self.assertEqual(fetcher.fetch('http://server.com/a.css'), b'h1 {}')
+        request = urlopen.call_args[0][0]
+        self.assertEqual(request.get_header('If-none-match'), '"v1"')
+        self.assertEqual(urlopen.call_args[1], {'timeout': 3})
+
+
 class CommaSelector(unittest.TestCase):
     def setUp(self):
         self.html = """<style>.b1,.b2 { font-weight:bold; } .c {color: red}</style><span class="b1">Bold</span><span class="b2 c">Bold Red</span>"""
@@ -185,24 +409,24 @@ class CommaSelector(unittest.TestCase):
         self.p._get_soup()
         self.p._get_styles()
         self.p._apply_styles()
-        self.assertEqual(unicode(self.p.soup), u'<span class="b1" style="font-weight: bold">Bold</span><span class="b2 c" style="color: red; font-weight: bold">Bold Red</span>')
+        self.assertEqual(unicode(self.p.soup), u'<span class="b1" style="font-weight: bold">Bold</span><span class="b2 c" style="font-weight: bold; color: red">Bold Red</span>')
 
     def test_run(self):
         """Test 'run' method"""
         output = self.p.run()
-        self.assertEqual(output, u'<span class="b1" style="font-weight: bold">Bold</span><span class="b2 c" style="color: red; font-weight: bold">Bold Red</span>')
+        self.assertEqual(output, u'<span class="b1" style="font-weight: bold">Bold</span><span class="b2 c" style="font-weight: bold; color: red">Bold Red</span>')
 
     def test_with_cssString(self):
         """Test 'with_cssString' method"""
         cssString = '.b1,.b2 {font-size: 2em;}'
         self.p = Pynliner().from_string(self.html).with_cssString(cssString)
         output = self.p.run()
-        self.assertEqual(output, u'<span class="b1" style="font-weight: bold; font-size: 2em">Bold</span><span class="b2 c" style="color: red; font-weight: bold; font-size: 2em">Bold Red</span>')
+        self.assertEqual(output, u'<span class="b1" style="font-weight: bold; font-size: 2em">Bold</span><span class="b2 c" style="font-weight: bold; color: red; font-size: 2em">Bold Red</span>')
 
     def test_fromString_complete(self):
         """Test 'fromString' complete"""
         output = pynliner.fromString(self.html)
-        desired = u'<span class="b1" style="font-weight: bold">Bold</span><span class="b2 c" style="color: red; font-weight: bold">Bold Red</span>'
+        desired = u'<span class="b1" style="font-weight: bold">Bold</span><span class="b2 c" style="font-weight: bold; color: red">Bold Red</span>'
         self.assertEqual(output, desired)
 
     def test_comma_whitespace(self):
@@ -470,6 +694,30 @@ class ComplexSelectors(unittest.TestCase):
         output = Pynliner().from_string(html).with_cssString(css).run()
         self.assertEqual(output, expected)
 
+    def test_nth_child_selector(self):
+        html = """<ul><li>1</li><li>2</li><li>3</li><li>4</li><li>5</li></ul>"""
+        css = """li:nth-child(odd) { color: red; } li:nth-child(-n+2) { font-weight: bold; }"""
+        expected = (u'<ul><li style="color: red; font-weight: bold">1</li>'
+                    u'<li style="font-weight: bold">2</li><li style="color: red">3</li>'
+                    u'<li>4</li><li style="color: red">5</li></ul>')
+        output = Pynliner().from_string(html).with_cssString(css).run()
+        self.assertEqual(output, expected)
+
+    def test_only_child_selector(self):
+        html = """<p><span>1</span></p><p><span>2</span><span>3</span></p>"""
+        css = """span:only-child { color: red; }"""
+        expected = (u'<p><span style="color: red">1</span></p>'
+                    u'<p><span>2</span><span>3</span></p>')
+        output = Pynliner().from_string(html).with_cssString(css).run()
+        self.assertEqual(output, expected)
+
+    def test_first_child_ignores_text(self):
+        html = """<p>Hello <b>World</b>!</p>"""
+        css = """b:first-child { color: red; }"""
+        expected = u'<p>Hello <b style="color: red">World</b>!</p>'
+        output = Pynliner().from_string(html).with_cssString(css).run()
+        self.assertEqual(output, expected)
+
     def test_attribute_selector_match(self):
         html = """<h1 title="foo">Hello World!</h1>"""
         css = """h1[title="foo"] { color: red; }"""
@@ -484,6 +732,578 @@ class ComplexSelectors(unittest.TestCase):
         output = Pynliner().from_string(html).with_cssString(css).run()
         self.assertEqual(output, expected)
 
+    def test_hyphenated_attribute_selector(self):
+        html = """<a x-apple-data-detectors="true">1</a><p data-x="2">2</p><p data-x="1">3</p>"""
+        css = """a[x-apple-data-detectors] { color: red; } p[data-x="1"] { color: blue; }"""
+        expected = (u'<a style="color: red" x-apple-data-detectors="true">1</a>'
+                    u'<p data-x="2">2</p><p data-x="1" style="color: blue">3</p>')
+        output = Pynliner().from_string(html).with_cssString(css).run()
+        self.assertEqual(output, expected)
+
+    def test_unparsable_selector_skips_rule(self):
+        html = """<h1>Hello World!</h1>"""
+        css = """h1, *|h1 { color: red; } h1 { font-weight: bold; }"""
+        expected = u"""<h1 style="font-weight: bold">Hello World!</h1>"""
+        output = Pynliner().from_string(html).with_cssString(css).run()
+        self.assertEqual(output, expected)
+
+    def test_descendant_selector_order(self):
+        html = """<p><em><span>Hello World!</span></em></p>"""
+        css = """em p span { color: red; } p em span { font-weight: bold; }"""
+        expected = u"""<p><em><span style="font-weight: bold">Hello World!</span></em></p>"""
+        output = Pynliner().from_string(html).with_cssString(css).run()
+        self.assertEqual(output, expected)
+
+    def test_element_matching_several_selectors_of_one_rule(self):
+        html = """<p class="a" id="b">Hello World!</p>"""
+        css = """p, .a, #b { color: red; }"""
+        expected = u"""<p class="a" id="b" style="color: red">Hello World!</p>"""
+        output = Pynliner().from_string(html).with_cssString(css).run()
+        self.assertEqual(output, expected)
+
+
+class CompiledStylesheetTests(unittest.TestCase):
+    def setUp(self):
+        self.css = pynliner.CompiledStylesheet('h1 { color: red; } .a, .b { font-weight: bold; }')
+
+    def test_rules(self):
+        self.assertEqual([rule.selector_text for rule in self.css.rules],
+                         ['h1', '.a, .b'])
+        self.assertEqual(self.css.rules[1].properties, [('font-weight', 'bold')])
+
+    def test_stylesheet_argument(self):
+        output = Pynliner(stylesheet=self.css).from_string('<h1>Hi</h1>').run()
+        self.assertEqual(output, u'<h1 style="color: red">Hi</h1>')
+
+    def test_shared_between_runs(self):
+        for html, expected in (
+                ('<h1 class="a">Hi</h1>', u'<h1 class="a" style="color: red; font-weight: bold">Hi</h1>'),
+                ('<p class="b">Hi</p>', u'<p class="b" style="font-weight: bold">Hi</p>')):
+            output = Pynliner().from_string(html).with_compiled_css(self.css).run()
+            self.assertEqual(output, expected)
+
+    def test_applied_after_other_css(self):
+        html = '<style>h1 { color: blue; }</style><h1>Hi</h1>'
+        output = Pynliner().from_string(html).with_compiled_css(self.css).run()
+        self.assertEqual(output, u'<h1 style="color: red">Hi</h1>')
+
+
+class CascadeTests(unittest.TestCase):
+    def test_serialize_matches_cssutils(self):
+        css = pynliner.CompiledStylesheet(
+            'a { color: #FFCC00; margin: 1.0em 0 0 0; font: 12px/1.5 "Helvetica Neue", Arial;'
+            ' background: url( "a b.png" ) no-repeat; *zoom: 1; mso-line-height-rule: exactly }'
+            ' b { color: red; margin: 0; color: blue }')
+        cascade = pynliner.Cascade()
+        declaration = cssutils.css.CSSStyleDeclaration()
+        for rule in css.rules:
+            cascade.apply(rule)
+            for name, value in rule.properties:
+                declaration.removeProperty(name)
+                declaration.setProperty(name, value)
+        self.assertEqual(cascade.serialize(), declaration.cssText.replace('\n', ' '))
+
+    def test_later_declaration_moves_to_end(self):
+        css = pynliner.CompiledStylesheet('a { color: red; margin: 0 } b { color: blue }')
+        cascade = pynliner.Cascade()
+        for rule in css.rules:
+            cascade.apply(rule)
+        self.assertEqual(cascade.serialize(), u'margin: 0; color: blue')
+
+
+class StylesheetCacheTests(unittest.TestCase):
+    def test_identical_style_blocks_are_parsed_once(self):
+        cache = pynliner.StylesheetCache(maxsize=2)
+        style = '<style>h1 { color: red; }</style>'
+        outputs = [Pynliner(style_cache=cache).from_string(style + body).run()
+                   for body in ('<h1>One</h1>', '<h1>Two</h1>')]
+        self.assertEqual(outputs, [u'<h1 style="color: red">One</h1>',
+                                   u'<h1 style="color: red">Two</h1>'])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(len(cache), 1)
+
+    def test_compile_returns_cached_stylesheet(self):
+        cache = pynliner.StylesheetCache()
+        self.assertIs(cache.compile(u'h1 { color: red; }'),
+                      cache.compile(u'h1 { color: red; }'))
+        self.assertIsNot(cache.compile(u'h1 { color: red; }'),
+                         cache.compile(u'h1 { color: blue; }'))
+
+
+class Batch(unittest.TestCase):
+    def setUp(self):
+        self.sources = ['<h1>One</h1>',
+                        '<style>h1 { font-weight: bold; }</style><h1>Two</h1>',
+                        '<p class="a">Three</p>']
+        self.css = 'h1 { color: red; } .a { color: blue; }'
+
+    def test_run_many_matches_run(self):
+        expected = [Pynliner().from_string(source).with_cssString(self.css).run()
+                    for source in self.sources]
+        p = Pynliner().with_cssString(self.css)
+        self.assertEqual(list(p.run_many(self.sources)), expected)
+
+    def test_inline_batch_is_lazy(self):
+        def sources():
+            yield '<h1>One</h1>'
+            raise AssertionError('read past the first document')
+        outputs = pynliner.inline_batch(sources(), self.css)
+        self.assertEqual(next(outputs), u'<h1 style="color: red">One</h1>')
+
+    def test_inline_batch_with_compiled_css(self):
+        css = pynliner.CompiledStylesheet(self.css)
+        outputs = list(pynliner.inline_batch(self.sources, css))
+        self.assertEqual(outputs[2], u'<p class="a" style="color: blue">Three</p>')
+
+
+class Incremental(unittest.TestCase):
+    def setUp(self):
+        self.html = ('<style>p { color: red; } li:last-child { margin: 0; }</style>'
+                     '<div><p style="font-size: 12px">One</p>'
+                     '<ul><li>a</li><li id="b">b</li></ul></div>')
+
+    def test_first_run_matches_run(self):
+        p = Pynliner(incremental=True).from_string(self.html)
+        self.assertEqual(p.run(), Pynliner().from_string(self.html).run())
+
+    def test_added_css_only_matches_new_rules(self):
+        stats = pynliner.InlineStats()
+        p = Pynliner(incremental=True, stats=stats).from_string(self.html)
+        p.run()
+        evaluated = stats.selectors_evaluated
+        output = p.with_cssString('p { color: blue; } li { padding: 0; }').run()
+        expected = Pynliner().from_string(self.html).with_cssString(
+            'p { color: blue; } li { padding: 0; }').run()
+        self.assertEqual(output, expected)
+        self.assertEqual(stats.selectors_evaluated - evaluated, 3)
+
+    def test_replace_fragment(self):
+        p = Pynliner(incremental=True).from_string(self.html)
+        p.run()
+        nodes = p.replace_fragment(p.soup.find(id='b'),
+                                   '<li id="b">b</li><li class="c">c</li>')
+        self.assertEqual([node['id'] if node.has_attr('id') else node['class']
+                          for node in nodes], ['b', ['c']])
+        expected = Pynliner().from_string(self.html.replace(
+            '<li id="b">b</li>', '<li id="b">b</li><li class="c">c</li>')).run()
+        self.assertEqual(p.run(), expected)
+
+    @unittest.skipUnless(lxml, 'lxml is not installed')
+    def test_replace_fragment_with_lxml(self):
+        p = Pynliner(incremental=True, parser='lxml').from_string(self.html)
+        p.run()
+        nodes = p.replace_fragment(p.soup.find(id='b'), '<li id="b">c</li>')
+        self.assertEqual([node.name for node in nodes], ['li'])
+        self.assertEqual(p.run(), Pynliner(parser='lxml').from_string(
+            self.html.replace('<li id="b">b</li>', '<li id="b">c</li>')).run())
+
+    def test_css_added_after_run_needs_incremental(self):
+        p = Pynliner().from_string(self.html)
+        p.run()
+        p.with_cssString('li { padding: 0; }')
+        self.assertEqual(p._get_stylesheets(),
+                         [p.stylesheet] + p.compiled_stylesheets)
+        self.assertNotIn('padding', p.run())
+
+    def test_replace_fragment_needs_incremental_run(self):
+        p = Pynliner().from_string(self.html)
+        p.run()
+        self.assertRaises(ValueError, p.replace_fragment, p.soup.find('p'), '')
+
+
+class ResultCaches(unittest.TestCase):
+    def setUp(self):
+        self.html = '<style>h1 { color: red; }</style><h1>Hi</h1>'
+        self.expected = u'<h1 style="color: red">Hi</h1>'
+
+    def test_repeat_run_is_cached(self):
+        cache = MemoryResultCache()
+        stats = pynliner.InlineStats()
+        self.assertEqual(Pynliner(result_cache=cache, stats=stats)
+                         .from_string(self.html).run(), self.expected)
+        with mock.patch.object(Pynliner, '_inline') as inline:
+            self.assertEqual(Pynliner(result_cache=cache, stats=stats)
+                             .from_string(self.html).run(), self.expected)
+            self.assertFalse(inline.called)
+        self.assertEqual((stats.result_hits, stats.result_misses), (1, 1))
+
+    def test_key_covers_css_and_options(self):
+        cache = MemoryResultCache()
+        Pynliner(result_cache=cache).from_string(self.html).run()
+        output = Pynliner(result_cache=cache).from_string(self.html) \
+            .with_cssString('h1 { margin: 0; }').run()
+        self.assertEqual(output, u'<h1 style="color: red; margin: 0">Hi</h1>')
+        Pynliner(result_cache=cache, parser='html.parser') \
+            .from_string(self.html).run()
+        self.assertEqual(len(cache), 3)
+
+    def test_memory_cap(self):
+        cache = MemoryResultCache(max_bytes=10)
+        cache['a'] = u'12345'
+        cache['b'] = u'\xe9' * 3
+        cache['c'] = u'1234'
+        self.assertEqual((len(cache), cache.size), (2, 10))
+        self.assertIsNone(cache.get('a'))
+        cache['d'] = u'x' * 11
+        self.assertNotIn('d', cache)
+
+    def test_disk_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        Pynliner(result_cache=DiskResultCache(directory)) \
+            .from_string(self.html).run()
+        cache = DiskResultCache(directory)
+        chunks = list(Pynliner(result_cache=cache).from_string(self.html)
+                      .iter_output(chunk_size=4))
+        self.assertEqual(u''.join(chunks), self.expected)
+        self.assertEqual(len(chunks), 8)
+        self.assertEqual(cache.hits, 1)
+
+    def test_iter_output_hit_is_not_stored_again(self):
+        stored = []
+
+        class RecordingCache(MemoryResultCache):
+            def __setitem__(self, key, value):
+                stored.append(key)
+                MemoryResultCache.__setitem__(self, key, value)
+
+        cache = RecordingCache()
+        list(Pynliner(result_cache=cache).from_string(self.html).iter_output())
+        del stored[:]
+        chunks = list(Pynliner(result_cache=cache).from_string(self.html)
+                      .iter_output())
+        self.assertEqual(u''.join(chunks), self.expected)
+        self.assertEqual((stored, cache.hits), ([], 1))
+
+    def test_iter_output_caches_empty_output(self):
+        cache = MemoryResultCache()
+        self.assertEqual(list(Pynliner(result_cache=cache).from_string('')
+                              .iter_output()), [])
+        self.assertEqual(len(cache), 1)
+
+    def test_disk_cache_keeps_line_endings(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache = DiskResultCache(directory)
+        cache['key'] = u'a\rb\r\nc\n'
+        self.assertEqual(cache.get('key'), u'a\rb\r\nc\n')
+        html = u'<p>a\r\nb\rc</p>'
+        output = Pynliner(result_cache=cache).from_string(html).run()
+        self.assertEqual(Pynliner(result_cache=cache).from_string(html).run(),
+                         output)
+        self.assertEqual(cache.hits, 2)
+
+
+class StylePlans(unittest.TestCase):
+    def setUp(self):
+        self.template = ('<style>p { color: red; } li:last-child { margin: 0; }'
+                         ' a[href^="https"] { color: green; }</style>'
+                         '<p class="hi">Hi %s</p><ul><li>%s</li><li>x</li></ul>'
+                         '<a href="%s" style="font-size: 1px" title="%s">link</a>')
+
+    def test_replay_matches_run(self):
+        plans = StylePlanCache()
+        stats = pynliner.InlineStats()
+        for name in ('Ann', 'Bob'):
+            html = self.template % (name, name, 'https://a', name)
+            output = Pynliner(plan_cache=plans, stats=stats).from_string(html).run()
+            self.assertEqual(output, Pynliner().from_string(html).run())
+        self.assertEqual((stats.plan_hits, stats.plan_misses), (1, 1))
+
+    def test_replay_skips_matching(self):
+        plans = StylePlanCache()
+        Pynliner(plan_cache=plans).from_string(
+            self.template % ('Ann', 'Ann', 'https://a', 'Ann')).run()
+        html = self.template % ('Bob', 'Bob', 'https://a', 'Bob')
+        with mock.patch.object(Pynliner, '_match_styles') as match:
+            output = Pynliner(plan_cache=plans).from_string(html).run()
+            self.assertFalse(match.called)
+        self.assertEqual(output, Pynliner().from_string(html).run())
+
+    def test_signature(self):
+        def signature(html):
+            return get_signature(BeautifulSoup(html, 'html.parser'), ['href'])[0]
+        base = signature('<p class="a">Hi <b>you</b></p><a href="#">x</a>')
+        self.assertEqual(signature('<p class="a">Bye<b></b></p><a href="#" title="t"></a>'),
+                         base)
+        self.assertNotEqual(signature('<p class="a"><b>you</b></p><a href="/">x</a>'), base)
+        self.assertNotEqual(signature('<p class="a"></p><b>you</b><a href="#">x</a>'), base)
+        self.assertNotEqual(signature('<p class="b">Hi <b>you</b></p><a href="#">x</a>'), base)
+
+
+class CommandLine(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.css = os.path.join(self.directory, 'base.css')
+        with io.open(self.css, 'w') as stream:
+            stream.write(u'p { color: red; }')
+
+    def test_directory(self):
+        source = os.path.join(self.directory, 'in')
+        os.makedirs(os.path.join(source, 'sub'))
+        for path in ('a.html', os.path.join('sub', 'b.html'), 'c.txt'):
+            with io.open(os.path.join(source, path), 'w') as stream:
+                stream.write(u'<p>%s</p>' % path)
+        target = os.path.join(self.directory, 'out')
+        stderr = io.StringIO()
+        cli.main(['--css', self.css, source, '-o', target], stderr=stderr)
+        with io.open(os.path.join(target, 'sub', 'b.html')) as stream:
+            self.assertEqual(stream.read(), u'<p style="color: red">%s</p>'
+                             % os.path.join('sub', 'b.html'))
+        self.assertFalse(os.path.exists(os.path.join(target, 'c.txt')))
+        self.assertTrue(stderr.getvalue().startswith(u'pynliner: 2 documents'))
+
+    def test_jsonl(self):
+        stdin = io.StringIO(u'{"id": 1, "html": "<p>x</p>"}\n\n'
+                            u'{"id": 2, "html": "<b>y</b>"}\n')
+        stdout = io.StringIO()
+        cli.main(['--css', self.css, '--jsonl'], stdin=stdin, stdout=stdout,
+                 stderr=io.StringIO())
+        self.assertEqual([json.loads(line) for line in stdout.getvalue().splitlines()],
+                         [{'id': 1, 'html': '<p style="color: red">x</p>'},
+                          {'id': 2, 'html': '<b>y</b>'}])
+
+
+    def test_directory_with_latin1_document(self):
+        source = os.path.join(self.directory, 'in')
+        os.makedirs(source)
+        with io.open(os.path.join(source, 'a.html'), 'wb') as stream:
+            stream.write(u'<meta charset="iso-8859-1"><p>caf\xe9</p>'
+                         .encode('latin-1'))
+        with io.open(os.path.join(source, 'b.html'), 'w') as stream:
+            stream.write(u'<p>b</p>')
+        target = os.path.join(self.directory, 'out')
+        self.assertEqual(cli.main(['--css', self.css, source, '-o', target],
+                                  stderr=io.StringIO()), 0)
+        with io.open(os.path.join(target, 'a.html'), encoding='utf-8') as stream:
+            self.assertIn(u'<p style="color: red">caf\xe9</p>', stream.read())
+        self.assertTrue(os.path.exists(os.path.join(target, 'b.html')))
+
+    def test_jsonl_reports_bad_line(self):
+        stdin = io.StringIO(u'{"id": 1, "html": "<p>x</p>"}\n'
+                            u'{"id": 2}\n{"id": 3, "html": "<p>z</p>"}\n')
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        status = cli.main(['--jsonl'], stdin=stdin, stdout=stdout, stderr=stderr)
+        self.assertEqual(status, 1)
+        self.assertEqual(stderr.getvalue(),
+                         u'pynliner: line 2: no "html" member\n')
+        self.assertEqual(len(stdout.getvalue().splitlines()), 1)
+
+class LazyImports(unittest.TestCase):
+    def test_import_does_not_load_dependencies(self):
+        code = ('import sys, pynliner; '
+                'print(sorted(set(["bs4", "cssutils", "concurrent.futures", '
+                '"urllib.request"]) & set(sys.modules)))')
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), b'[]')
+
+    def test_reexported_names(self):
+        self.assertIs(pynliner.CompiledStylesheet,
+                      pynliner.stylesheet.CompiledStylesheet)
+        self.assertRaises(AttributeError, getattr, pynliner, 'missing')
+
+
+class Parallel(unittest.TestCase):
+    def setUp(self):
+        self.sources = ['<h1>%d</h1>' % i for i in range(7)]
+        self.css = 'h1 { color: red; }'
+        self.expected = [u'<h1 style="color: red">%d</h1>' % i for i in range(7)]
+
+    def test_compiled_stylesheet_pickles(self):
+        css = pickle.loads(pickle.dumps(pynliner.CompiledStylesheet(self.css)))
+        self.assertEqual([rule.selector_text for rule in css.rules], ['h1'])
+
+    def test_worker_compiles_css_once(self):
+        settings = (self.css, False, None)
+        inliner = parallel._get_worker_inliner(settings)
+        self.assertIs(parallel._get_worker_inliner((self.css, False, None)), inliner)
+        self.assertIsNot(parallel._get_worker_inliner((self.css, True, None)), inliner)
+
+    def test_ordered(self):
+        outputs = inline_parallel(self.sources, pynliner.CompiledStylesheet(self.css),
+                                  processes=2, chunksize=2)
+        self.assertEqual(list(outputs), self.expected)
+
+    def test_unordered(self):
+        outputs = inline_parallel(self.sources, self.css, processes=2,
+                                  chunksize=3, ordered=False)
+        self.assertEqual(sorted(outputs), list(enumerate(self.expected)))
+
+
+class SelectorSetTests(unittest.TestCase):
+    def setUp(self):
+        self.soup = BeautifulSoup(
+            '<div id="main"><p class="a b">1</p><p>2</p><span class="b">3</span></div>',
+            'html.parser')
+
+    def test_match_in_insertion_order(self):
+        selectors = SelectorSet()
+        selectors.add('.b', 'class')
+        selectors.add('p', 'tag')
+        selectors.add('#main p', 'descendant')
+        selectors.add('*', 'universal')
+        first = self.soup.find('p')
+        self.assertEqual(selectors.match(first),
+                         ['class', 'tag', 'descendant', 'universal'])
+
+    def test_select_walks_document_order(self):
+        selectors = SelectorSet()
+        selectors.add('div > .b', 'b')
+        matched = [(el.get_text(), data) for el, data in selectors.select(self.soup)]
+        self.assertEqual(matched, [(u'1', ['b']), (u'3', ['b'])])
+
+
+class CompiledSelectorTests(unittest.TestCase):
+    def setUp(self):
+        self.soup = BeautifulSoup(
+            '<div id="main"><ul><li><a href="#">1</a></li></ul><a>2</a></div>',
+            'html.parser')
+
+    def test_compile_selector_is_cached(self):
+        self.assertIs(compile_selector('div#main ul a'),
+                      compile_selector('div#main ul a'))
+
+    def test_match(self):
+        compiled = compile_selector('div#main ul a')
+        first, second = self.soup.find_all('a')
+        self.assertTrue(compiled.match(first))
+        self.assertFalse(compiled.match(second))
+
+    def test_select(self):
+        self.assertEqual([a.string for a in select(self.soup, 'div > a')], [u'2'])
+        self.assertEqual([a.string for a in select(self.soup, 'a[href]')], [u'1'])
+
+
+class AncestorFilterTests(unittest.TestCase):
+    def setUp(self):
+        self.soup = BeautifulSoup(
+            '<table class="t"><tr><td id="c"><p>1</p><p class="x">2</p></td></tr></table>'
+            '<div><p>3</p></div>', 'html.parser')
+
+    def test_walk_document_order(self):
+        self.assertEqual([el for el, ancestors in walk(self.soup)],
+                         self.soup.find_all(True))
+
+    def test_ancestor_tokens(self):
+        self.assertEqual(compile_selector('table.t td > p + p.x').ancestor_tokens,
+                         ['td', '.t', 'table'])
+        self.assertEqual(compile_selector('p + p').ancestor_tokens, [])
+
+    def test_filter_tracks_ancestors(self):
+        seen = dict((el.string, set(ancestors.counts))
+                    for el, ancestors in walk(self.soup) if el.name == 'p')
+        self.assertEqual(seen[u'2'], set(['table', '.t', 'tr', 'td', '#c']))
+        self.assertEqual(seen[u'3'], set(['div']))
+
+    def test_match_sets_with_filter(self):
+        selectors = SelectorSet()
+        for selector in ('table p', '.t #c > p', 'div p', 'p + .x', 'tr p'):
+            selectors.add(selector, selector)
+        matched = [(el.string, data) for el, data in match_sets(self.soup, [selectors])]
+        self.assertEqual(matched, [
+            (u'1', ['table p', '.t #c > p', 'tr p']),
+            (u'2', ['table p', '.t #c > p', 'p + .x', 'tr p']),
+            (u'3', ['div p'])])
+
+
+class StructuralPseudoClasses(unittest.TestCase):
+    def test_parse_nth(self):
+        for argument, expected in (('odd', (2, 1)), ('even', (2, 0)), ('3', (0, 3)),
+                                   ('n', (1, 0)), ('2n+1', (2, 1)), ('-n+3', (-1, 3)),
+                                   ('3n-2', (3, -2)), ('+5', (0, 5))):
+            self.assertEqual(parse_nth(argument), expected)
+        self.assertRaises(ValueError, parse_nth, 'foo')
+
+    def test_siblings_computed_once_per_parent(self):
+        soup = BeautifulSoup('<ul>%s</ul>' % ('<li>x</li> ' * 50), 'html.parser')
+        context = MatchContext()
+        compiled = compile_selector('li:last-child')
+        matched = [li for li in soup.find_all('li') if compiled.match(li, context)]
+        self.assertEqual(matched, [soup.find_all('li')[-1]])
+        self.assertEqual(len(context._siblings), 1)
+
+
+class SiblingCombinators(unittest.TestCase):
+    def setUp(self):
+        self.soup = BeautifulSoup('<h1>t</h1> text <p>1</p><span></span><p>2</p>',
+                                  'html.parser')
+
+    def test_general_sibling(self):
+        self.assertEqual([p.string for p in select(self.soup, 'h1 ~ p')], ['1', '2'])
+        self.assertEqual([p.string for p in select(self.soup, 'span ~ p')], ['2'])
+        self.assertEqual(select(self.soup, 'p ~ h1'), [])
+
+    def test_adjacent_sibling_skips_text(self):
+        self.assertEqual([p.string for p in select(self.soup, 'h1 + p')], ['1'])
+        self.assertEqual([p.string for p in select(self.soup, 'span + p')], ['2'])
+
+    def test_general_sibling_resolved_once_per_parent(self):
+        soup = BeautifulSoup('<ul><li class="a">x</li>%s</ul>' % ('<li>x</li>' * 50),
+                             'html.parser')
+        context = MatchContext()
+        compiled = compile_selector('.a ~ li')
+        self.assertEqual(sum(compiled.match(li, context) for li in soup.find_all('li')), 50)
+        self.assertEqual(len(context._first_matches), 1)
+
+    def test_sibling_compounds_are_not_ancestors(self):
+        self.assertEqual(compile_selector('.x .a + .b .c').ancestor_tokens,
+                         ['.b', '.x'])
+        html = ('<style>.a ~ .b .c { color: red; }</style>'
+                '<div class="a"></div><div class="b"><p class="c">x</p></div>')
+        self.assertEqual(Pynliner().from_string(html).run(),
+                         '<div class="a"></div><div class="b">'
+                         '<p class="c" style="color: red">x</p></div>')
+
+
+class DocumentIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.soup = BeautifulSoup(
+            '<div id="main" class="a"><p class="a b">1</p><p class="b">2</p>'
+            '<span class="a b">3</span></div>', 'html.parser')
+        self.index = DocumentIndex(self.soup)
+
+    def test_candidates_intersect_postings(self):
+        candidates = self.index.candidates(compile_selector('p.a.b').subject)
+        self.assertEqual([el.string for el in candidates], [u'1'])
+        candidates = self.index.candidates(compile_selector('.b').subject)
+        self.assertEqual([el.string for el in candidates], [u'1', u'2', u'3'])
+        self.assertEqual(self.index.candidates(compile_selector('#nope.a').subject), [])
+
+    def test_select_with_index(self):
+        for selector in ('.a', 'div > .b', '*', 'p + span.a', '#main'):
+            self.assertEqual(select(self.soup, selector, self.index),
+                             select(self.soup, selector))
+
+    def test_tokens(self):
+        self.assertEqual(self.index.tokens,
+                         set(['div', 'p', 'span', '#main', '.a', '.b']))
+
+    def test_filtered_selector_set(self):
+        selectors = SelectorSet()
+        for selector in ('p.a', '.missing', 'div > p.b', 'table td', '#main span', 'p + #other'):
+            selectors.add(selector, selector)
+        filtered = selectors.filtered(self.index)
+        self.assertEqual([data for order, compiled, data in filtered.entries()],
+                         ['p.a', 'div > p.b', '#main span'])
+        self.assertEqual(len(filtered), 3)
+        self.assertEqual(list(match_sets(self.soup, [filtered])),
+                         list(match_sets(self.soup, [selectors])))
+
+
+class LRUCacheTests(unittest.TestCase):
+    def test_eviction_and_counters(self):
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
 
 if __name__ == '__main__':
     unittest.main()
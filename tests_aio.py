@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the asyncio support, which needs Python 3.5+. Run as part of
+tests.py.
+"""
+import asyncio
+import unittest
+
+from pynliner import Pynliner
+from pynliner.fetch import DictFetcher
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class Async(unittest.TestCase):
+    def test_afrom_url_and_arun(self):
+        fetcher = DictFetcher({
+            'http://server.com/page/index.html':
+                '<link rel="stylesheet" href="style.css"/><h1>Hi</h1>',
+            'http://server.com/page/style.css': 'h1 { color: red; }',
+        })
+
+        async def render():
+            p = await Pynliner(fetcher=fetcher).afrom_url('http://server.com/page/index.html')
+            return await p.arun()
+
+        self.assertEqual(run(render()), u'<h1 style="color: red">Hi</h1>')
+
+    def test_arun_many_in_flight(self):
+        async def render_all():
+            return await asyncio.gather(*[
+                Pynliner().from_string('<h1>%d</h1>' % i).with_cssString('h1 { color: red; }').arun()
+                for i in range(5)])
+
+        self.assertEqual(run(render_all()),
+                         [u'<h1 style="color: red">%d</h1>' % i for i in range(5)])
+
+
+if __name__ == '__main__':
+    unittest.main()